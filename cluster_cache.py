@@ -0,0 +1,119 @@
+from utils import *
+import hashlib
+import json
+import os
+
+class ClusterCache:
+    """
+    Cache of region clusterings, keyed by a hash of the clustered task
+    coordinates together with the region type, the number of clusters and the
+    cluster size limits.
+
+    TaskAllocator clusters the same task list again for every fleet
+    composition of a sweep, and since the fits are seeded the results are
+    identical, so repeats are served from the cache. On a miss, the centroids
+    of the last clustering with the same settings are used to warm-start the
+    fit when at least warm_start_overlap of the new tasks were part of it,
+    which converges in a few iterations when the task set only changed
+    slightly.
+
+    Entries can be persisted to a JSON file with save(). A cache given a path
+    loads it on creation if it exists.
+    """
+
+    def __init__(self, path=None, warm_start_overlap=0.8):
+        self.path = path
+        self.warm_start_overlap = warm_start_overlap
+        # {key: (centers, labels)}
+        self.entries = {}
+        # {settings: (points, centers)} of the last clustering with those settings
+        self.last_fits = {}
+        self.hits = 0
+        self.misses = 0
+        self.warm_starts = 0
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __repr__(self):
+        return (f"ClusterCache(size={len(self.entries)}, hits={self.hits}, " +
+                f"misses={self.misses}, warm_starts={self.warm_starts})")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, points, settings):
+        points = np.ascontiguousarray(points, dtype=float)
+        digest = hashlib.sha1(repr((points.shape, settings)).encode())
+        digest.update(points.tobytes())
+        return digest.hexdigest()
+
+    def warm_start(self, points, settings):
+        """
+        Returns the centroids of the last clustering with the same settings if
+        enough of points were part of it, otherwise None.
+        """
+        last = self.last_fits.get(settings)
+        if last is None or not len(points):
+            return None
+        last_points, centers = last
+        seen = set(map(tuple, last_points.tolist()))
+        overlap = sum(tuple(p) in seen for p in points.tolist()) / len(points)
+        return centers if overlap >= self.warm_start_overlap else None
+
+    def get(self, points, settings, compute):
+        """
+        Returns (centers, labels) for clustering points with settings,
+        computing it on a miss with compute(init), where init is the
+        warm-start centroids or None.
+
+        Args:
+            points (array): (n_tasks, n_features) coordinates to cluster
+            settings (tuple): hashable clustering settings, e.g. the region
+                type, number of clusters and size limits
+            compute (callable): returns (centers, labels) arrays
+        """
+        points = np.asarray(points, dtype=float)
+        key = self.key(points, settings)
+        if key in self.entries:
+            self.hits += 1
+            centers, labels = self.entries[key]
+        else:
+            self.misses += 1
+            init = self.warm_start(points, settings)
+            if init is not None:
+                self.warm_starts += 1
+            centers, labels = compute(init)
+            centers, labels = np.asarray(centers, dtype=float), np.asarray(labels, dtype=int)
+            self.entries[key] = (centers, labels)
+        self.last_fits[settings] = (points, centers)
+        return centers, labels
+
+    def stats(self):
+        """
+        Returns the hit, miss and warm start counters as a dict.
+        """
+        return {"hits": self.hits, "misses": self.misses, "warm_starts": self.warm_starts}
+
+    def save(self, path=None):
+        """
+        Writes the cached clusterings to path, by default the cache's own.
+        """
+        path = self.path if path is None else path
+        entries = {key: {"centers": centers.tolist(), "labels": labels.tolist()}
+                   for key, (centers, labels) in self.entries.items()}
+        with open(path, "w") as f:
+            json.dump(entries, f)
+
+    def load(self, path):
+        with open(path) as f:
+            entries = json.load(f)
+        for key, entry in entries.items():
+            self.entries[key] = (np.array(entry["centers"], dtype=float).reshape(len(entry["centers"]), -1),
+                                 np.array(entry["labels"], dtype=int))
+
+    def clear(self):
+        self.entries = {}
+        self.last_fits = {}
+        self.hits = 0
+        self.misses = 0
+        self.warm_starts = 0
@@ -0,0 +1,237 @@
+from utils import *
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from k_means_constrained import KMeansConstrained
+from scipy.spatial import cKDTree
+import time
+
+class ExactClustering:
+    """
+    Full-batch KMeans, or KMeansConstrained when size limits are given. The
+    constrained fit solves a min-cost flow over every point and cluster, so
+    it becomes slow beyond a few thousand tasks.
+
+    All clustering backends share fit(points, n_clusters, size_min,
+    size_max, init), which returns the (n_clusters, n_features) centers and
+    the label of every point, and leave the wall time of each phase of the
+    last fit in self.timings.
+    """
+    name = "exact"
+
+    def __init__(self):
+        self.timings = {}
+
+    def __repr__(self):
+        return f"{type(self).__name__}(timings={self.timings})"
+
+    def fit(self, points, n_clusters, size_min=None, size_max=None, init=None):
+        start = time.perf_counter()
+        if size_min is None and size_max is None:
+            KM_tasks = KMeans(
+                        n_clusters=n_clusters,
+                        random_state=0,
+                        n_init='auto' if init is None else 1,
+                        init='k-means++' if init is None else init
+                    ).fit(points)
+        else:
+            KM_tasks = KMeansConstrained(
+                        n_clusters=n_clusters,
+                        size_min=size_min,
+                        size_max=size_max,
+                        random_state=0,
+                        n_init=10 if init is None else 1,
+                        init='k-means++' if init is None else init
+                    ).fit(points)
+        self.timings = {"fit": time.perf_counter() - start}
+        return KM_tasks.cluster_centers_, KM_tasks.labels_
+
+class MiniBatchClustering(ExactClustering):
+    """
+    MiniBatchKMeans followed by a greedy repair of the cluster sizes.
+
+    The repair reassigns every point to the nearest of its n_candidates
+    nearest centers that still has room, doubling the candidates for points
+    that find them all full and taking the points that lose the most by not
+    getting their first choice first. Identical points are placed as one
+    weighted point, which keeps the repair fast on the few distinct pick
+    points of a warehouse. It then fills clusters below
+    size_min with the nearest points of clusters that can spare them. Every
+    cluster gets at least one point. The repair is repeated n_refine times
+    from the means of the repaired clusters, as balanced Lloyd iterations.
+    """
+    name = "minibatch"
+
+    def __init__(self, batch_size=4096, n_candidates=8, n_refine=5):
+        super().__init__()
+        self.batch_size = batch_size
+        self.n_candidates = n_candidates
+        self.n_refine = n_refine
+
+    def fit(self, points, n_clusters, size_min=None, size_max=None, init=None):
+        points = np.asarray(points, dtype=float)
+        start = time.perf_counter()
+        KM_tasks = MiniBatchKMeans(
+                    n_clusters=n_clusters,
+                    batch_size=self.batch_size,
+                    random_state=0,
+                    n_init='auto' if init is None else 1,
+                    init='k-means++' if init is None else init
+                ).fit(points)
+        fitted = time.perf_counter()
+
+        size_min = max(size_min or 0, 1 if len(points) >= n_clusters else 0)
+        size_max = len(points) if size_max is None else size_max
+        centers = KM_tasks.cluster_centers_
+        for _ in range(self.n_refine + 1):
+            labels = self.balance(points, centers, size_min, size_max)
+            centers = cluster_means(points, labels, n_clusters, centers)
+        self.timings = {"fit": fitted - start, "repair": time.perf_counter() - fitted}
+        return centers, labels
+
+    def balance(self, points, centers, size_min, size_max):
+        """
+        Returns labels assigning points to centers with at most size_max and,
+        where possible, at least size_min points per center.
+        """
+        n_points, n_clusters = len(points), len(centers)
+        sizes = np.zeros(n_clusters, dtype=int)
+
+        # Tasks share pick points, so identical points are placed together as one weighted point
+        unique, inverse, counts = np.unique(points, axis=0, return_inverse=True, return_counts=True)
+        remaining = counts.copy()
+        shares = [[] for _ in range(len(unique))]
+
+        # Points whose candidates filled up try again among twice as many centers with room left
+        pending = np.arange(len(unique))
+        n_candidates = self.n_candidates
+        while len(pending):
+            open_clusters = np.flatnonzero(sizes < size_max)
+            q = min(n_candidates, len(open_clusters))
+            n_candidates *= 2
+            dists, candidates = cKDTree(centers[open_clusters]).query(unique[pending], k=q)
+            dists = dists.reshape(len(pending), q)
+            candidates = open_clusters[candidates.reshape(len(pending), q)]
+
+            # Points with the most to lose from missing their nearest center pick first
+            regret = dists[:, -1] - dists[:, 0]
+            for j in np.argsort(-regret, kind="stable").tolist():
+                u = pending[j]
+                for c in candidates[j].tolist():
+                    take = min(remaining[u], size_max - sizes[c])
+                    if take > 0:
+                        shares[u].append((c, take))
+                        sizes[c] += take
+                        remaining[u] -= take
+                        if not remaining[u]:
+                            break
+            pending = np.flatnonzero(remaining > 0)
+
+        labels = np.empty(n_points, dtype=int)
+        members = np.split(np.argsort(inverse.ravel(), kind="stable"), np.cumsum(counts)[:-1])
+        for u, share in enumerate(shares):
+            clusters, takes = zip(*share)
+            labels[members[u]] = np.repeat(clusters, takes)
+
+        point_tree = None
+        for c in np.flatnonzero(sizes < size_min).tolist():
+            if point_tree is None:
+                point_tree = cKDTree(points)
+            k = min(n_points, 4 * size_min)
+            while sizes[c] < size_min:
+                _, nearest = point_tree.query(centers[c], k=k)
+                for i in np.atleast_1d(nearest).tolist():
+                    if sizes[c] >= size_min:
+                        break
+                    if labels[i] != c and sizes[labels[i]] > size_min:
+                        sizes[labels[i]] -= 1
+                        labels[i] = c
+                        sizes[c] += 1
+                if k == n_points:
+                    break
+                k = min(n_points, 2 * k)
+        return labels
+
+class CurveClustering(ExactClustering):
+    """
+    Space-filling curve bucketing: points are ordered along a Hilbert curve
+    (a Z-order curve beyond two dimensions) over a 2**bits grid spanning
+    their bounding box, and the order is cut into n_clusters runs of nearly
+    equal length. Runs of a Hilbert curve are spatially compact, and equal
+    runs keep every cluster within the size limits whenever n_clusters allows
+    it. Costs a sort, with no iterations, and ignores warm starts.
+    """
+    name = "curve"
+
+    def __init__(self, bits=16):
+        super().__init__()
+        self.bits = bits
+
+    def fit(self, points, n_clusters, size_min=None, size_max=None, init=None):
+        points = np.asarray(points, dtype=float)
+        start = time.perf_counter()
+        lo, hi = points.min(axis=0), points.max(axis=0)
+        cells = ((points - lo) / np.maximum(hi - lo, 1e-9) * (2 ** self.bits - 1)).astype(np.int64)
+        if points.shape[1] == 2:
+            keys = hilbert_index(cells[:, 0], cells[:, 1], self.bits)
+        else:
+            keys = morton_index(cells, self.bits)
+        order = np.argsort(keys, kind="stable")
+
+        # Cluster i takes the order from bounds[i] to bounds[i + 1]
+        bounds = (np.arange(n_clusters + 1) * len(points)) // n_clusters
+        labels = np.empty(len(points), dtype=int)
+        labels[order] = np.repeat(np.arange(n_clusters), np.diff(bounds))
+        centers = cluster_means(points, labels, n_clusters, np.zeros((n_clusters, points.shape[1])))
+        self.timings = {"fit": time.perf_counter() - start}
+        return centers, labels
+
+def cluster_means(points, labels, n_clusters, fallback):
+    """
+    Returns the mean of each cluster's points, or its fallback row if empty.
+    """
+    sizes = np.bincount(labels, minlength=n_clusters)
+    sums = np.zeros((n_clusters, points.shape[1]))
+    np.add.at(sums, labels, points)
+    return np.where(sizes[:, None] > 0, sums / np.maximum(sizes, 1)[:, None], fallback)
+
+def hilbert_index(x, y, bits):
+    """
+    Returns the distance along a Hilbert curve of the integer coordinates
+    (x, y) in [0, 2**bits), for arrays of coordinates.
+    """
+    x, y = np.array(x, dtype=np.int64), np.array(y, dtype=np.int64)
+    d = np.zeros_like(x)
+    n = 1 << bits
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve inside it has the base orientation
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s >>= 1
+    return d
+
+def morton_index(cells, bits):
+    """
+    Returns the Z-order index of every row of an (n, d) array of integer
+    coordinates in [0, 2**bits), interleaving the bits of each axis.
+    """
+    n_dims = cells.shape[1]
+    # Drop low bits so the interleaved key fits in an int64
+    kept = min(bits, 63 // n_dims)
+    cells = cells >> (bits - kept)
+    bits = kept
+    keys = np.zeros(len(cells), dtype=np.int64)
+    for b in range(bits):
+        for axis in range(n_dims):
+            keys |= ((cells[:, axis] >> b) & 1) << (b * n_dims + axis)
+    return keys
+
+CLUSTERING_BACKENDS = {
+    "exact" :       ExactClustering,
+    "minibatch" :   MiniBatchClustering,
+    "curve" :       CurveClustering
+}
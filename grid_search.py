@@ -0,0 +1,337 @@
+from utils import *
+import numpy as np
+import itertools
+import heapq
+import time
+
+# Spatial (dx, dy, dz) moves of each motion model, not counting waiting in place
+MOTION_DELTAS = {
+    "wait" :    [(0, 0, dz) for dz in (-1, 1)],
+    "drone" :   [d for d in itertools.product([-1,0,1], repeat=3) if d != (0, 0, 0)],
+    "amr" :     [(1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0)],
+}
+
+def motion_model(path_type):
+    """
+    Returns the motion model name for a path type: "W..." waits in place,
+    "D..." are drones, and anything else is planned as an AMR.
+    """
+    if path_type.lower().startswith("w"):
+        return "wait"
+    elif path_type.lower().startswith("d"):
+        return "drone"
+    return "amr"
+
+def step_cost(delta):
+    """
+    Cost of one timestep of a move, matching the g cost of CA*: the length of
+    the (dx, dy, dz, dt) step.
+    """
+    return math.sqrt(sum(d * d for d in delta) + 1)
+
+class GridGraph:
+    """
+    Integer encoding of a WarehouseMap's occupancy matrix for search.
+
+    The matrix is padded by one blocked cell on every side and flattened, so a
+    cell is a single int and every move of a motion model is a constant offset
+    that never needs a bounds check: stepping off the map lands on a blocked
+    padding cell.
+    """
+
+    def __init__(self, wh_map):
+        self.wh_map = wh_map
+        occ = wh_map.occupancy_matrix
+        self.shape = occ.shape
+
+        padded = np.pad(occ, 1, constant_values=True)
+        self.padded_shape = padded.shape
+        self.n_cells = padded.size
+        self.blocked = padded.ravel().tolist()
+
+        _, y_pad, z_pad = self.padded_shape
+        self.strides = (y_pad * z_pad, z_pad, 1)
+
+        # Flat index of each padded cell in the unpadded matrix (-1 for padding), as used by ReservationTable, and back
+        unpadded_ids = np.full(self.padded_shape, -1, dtype=np.int64)
+        unpadded_ids[1:-1, 1:-1, 1:-1] = np.arange(occ.size).reshape(occ.shape)
+        self.table_ids = unpadded_ids.ravel().tolist()
+        self.graph_ids = np.flatnonzero(unpadded_ids.ravel() >= 0).tolist()
+
+        # (offset, cost) of every move of each motion model, waiting in place first
+        self.moves = {}
+        for model, deltas in MOTION_DELTAS.items():
+            self.moves[model] = [(0, step_cost((0, 0, 0)))] + [(self.offset(d), step_cost(d)) for d in deltas]
+
+    def __repr__(self):
+        return f"GridGraph(shape={self.shape}, n_cells={self.n_cells})"
+
+    def offset(self, delta):
+        return sum(d * s for d, s in zip(delta, self.strides))
+
+    def encode(self, cell):
+        """
+        Returns the flat id of a Cell (or (x, y, z) tuple).
+        """
+        x, y, z = cell
+        return (x + 1) * self.strides[0] + (y + 1) * self.strides[1] + (z + 1)
+
+    def decode(self, cell_id):
+        """
+        Returns the (x, y, z) cell of a flat id.
+        """
+        x, rem = divmod(cell_id, self.strides[0])
+        y, z = divmod(rem, self.strides[1])
+        return (x - 1, y - 1, z - 1)
+
+    def in_bounds(self, cell_id, bounds):
+        """
+        Returns True if a cell lies in bounds, given as ((x0, x1), (y0, y1), (z0, z1))
+        with exclusive upper limits.
+        """
+        return all(lo <= c < hi for c, (lo, hi) in zip(self.decode(cell_id), bounds))
+
+    def dijkstra(self, source_id, model, bounds=None, metric="cost"):
+        """
+        Runs Dijkstra's algorithm over free cells from source_id, optionally
+        without leaving bounds.
+
+        Returns:
+            tuple: (dist, parent) dicts of the cost to and previous cell of
+                every reached cell id
+        """
+        moves = self.moves[model][1:]
+        if metric == "hops":
+            moves = [(offset, 1) for offset, _ in moves]
+        blocked = self.blocked
+
+        dist = {source_id: 0.0}
+        parent = {source_id: None}
+        open_list = [(0.0, source_id)]
+
+        while open_list:
+            d, cell = heapq.heappop(open_list)
+            if d > dist[cell]:
+                continue
+            for offset, cost in moves:
+                neighbor = cell + offset
+                if blocked[neighbor] or d + cost >= dist.get(neighbor, math.inf):
+                    continue
+                if bounds is not None and not self.in_bounds(neighbor, bounds):
+                    continue
+                dist[neighbor] = d + cost
+                parent[neighbor] = cell
+                heapq.heappush(open_list, (d + cost, neighbor))
+
+        return dist, parent
+
+    def path_cost(self, cell_ids):
+        """
+        Returns the CA* cost of a path of cell ids visited at consecutive timesteps.
+        """
+        cells = [self.decode(cell_id) for cell_id in cell_ids]
+        return sum(step_cost([b - a for a, b in zip(c1, c2)]) for c1, c2 in zip(cells, cells[1:]))
+
+    def trace(self, parent, cell_id):
+        """
+        Returns the cells from the source of a dijkstra() parent dict to cell_id.
+        """
+        path = []
+        while cell_id is not None:
+            path.append(cell_id)
+            cell_id = parent[cell_id]
+        return path[::-1]
+
+class SpaceTimeAStar:
+    """
+    CA* search over (cell, timestep) states.
+
+    A state is the int layer * n_cells + cell_id, where layer is the number of
+    timesteps since the start of the query. g-scores and parents are dicts
+    keyed by state and the closed states a set, all local to one query, so
+    memory grows with the states the search touches rather than the grid
+    size times the horizon, e.g. for long waits, and is freed when the query
+    returns. The open list is a heap of (f, state) tuples, and stale entries
+    are skipped when popped rather than removed.
+
+    A pruner, e.g. a JumpPointPruner, can be set to cut down the successors
+    generated for its motion model.
+
+    With bounded set, closed states are reopened when reached more cheaply,
+    so the open list always holds a state of an optimal path with its
+    optimal g. The smallest unweighted g + h over the open list (or the cost
+    found, if lower) is then a lower bound on the optimal cost, which a
+    search that found a path leaves in lower_bound. Weighted searches for
+    ECBS use it to bound their suboptimality.
+
+    With goal_hold set, the goal is only reached at a timestep if it stays
+    unreserved for goal_hold more timesteps after it (and the lookahead
+    one), for robots whose next leg is planned later and starts there.
+
+    expanded is always kept, as expansion budgets are charged with it. The
+    generated, peak_open and rejected counters are only counted with
+    record_stats, and are 0 otherwise.
+    """
+    metric = "cost"
+
+    def __init__(self, graph, reservations, record_stats=False):
+        self.graph = graph
+        self.reservations = reservations
+        self.record_stats = record_stats
+
+        self.expanded = 0
+        self.generated = 0
+        self.peak_open = 0
+        self.rejected = 0
+        self.pruner = None
+        self.bounded = False
+        self.lower_bound = None
+        self.goal_hold = 0
+
+    def __repr__(self):
+        return f"SpaceTimeAStar({self.graph})"
+
+    def search(self, start_id, goal_id, start_time, end_time, model, h_field, owner=None, max_closed=math.inf,
+               epsilon=1.0, deadline=None):
+        """
+        Finds the cheapest path from start_id at start_time to goal_id at or
+        after end_time that avoids shelves and reserved nodes. With epsilon > 1
+        the heuristic is inflated (weighted A*), trading up to a factor of
+        epsilon in path cost for fewer expansions.
+
+        Args:
+            start_id (int): GridGraph id of the start cell
+            goal_id (int): GridGraph id of the goal cell
+            start_time (int): timestep the robot leaves the start
+            end_time (int): earliest timestep the robot may finish
+            model (str): motion model, a key of MOTION_DELTAS
+            h_field (list): distance to the goal of every GridGraph cell
+            owner (hashable, optional): robot planned for, used to tell swaps
+                with other robots apart
+            max_closed (int, optional): number of expansions after which the
+                search gives up
+            epsilon (float, optional): heuristic weight. Defaults to 1.0.
+            deadline (float, optional): time.perf_counter() value after which
+                the search gives up
+
+        Returns:
+            list: GridGraph ids of the cell at every timestep, or None if no
+                path was found within the budget
+        """
+        n = self.graph.n_cells
+        blocked = self.graph.blocked
+        table_ids = self.graph.table_ids
+        moves = self.graph.moves[model]
+        owners = self.reservations.owners
+        rn = self.reservations.n_cells
+        inf = math.inf
+        count = self.record_stats
+        bounded = self.bounded
+        hold_keys = [dt * rn + table_ids[goal_id] for dt in range(2, self.goal_hold + 2)]
+
+        pruner = self.pruner if self.pruner is not None and self.pruner.model == model else None
+        if pruner is not None:
+            pruner.reset()
+
+        g = {start_id: 0.0}
+        parent = {start_id: -1}
+        closed = set()
+        open_list = [(epsilon * max(h_field[start_id], end_time - start_time), start_id)]
+        n_closed = n_skipped = n_rejected = peak_open = 0
+        goal_state = None
+
+        while open_list:
+            if count and len(open_list) > peak_open:
+                peak_open = len(open_list)
+            _, state = heapq.heappop(open_list)
+            if state in closed:
+                if count:
+                    n_skipped += 1
+                continue
+            if n_closed > max_closed or (deadline is not None and not n_closed & 1023 and time.perf_counter() > deadline):
+                n_skipped += 1
+                break
+            closed.add(state)
+            n_closed += 1
+
+            layer, cell = divmod(state, n)
+            t = start_time + layer
+            if cell == goal_id and t >= end_time and not any(t * rn + key in owners for key in hold_keys):
+                goal_state = state
+                break
+
+            g_cur = g[state]
+            base = (layer + 1) * n
+            wait_left = end_time - t - 1
+            next_key = (t + 1) * rn
+            swap_key = next_key + table_ids[cell]
+
+            cell_moves = moves
+            if pruner is not None and layer:
+                cell_moves = pruner.successors(cell, parent[state] % n, t) or moves
+
+            for offset, cost in cell_moves:
+                neighbor = cell + offset
+                if blocked[neighbor]:
+                    continue
+
+                # Reserved at the next timestep or the one after it
+                key = next_key + table_ids[neighbor]
+                if key in owners or key + rn in owners:
+                    if count:
+                        n_rejected += 1
+                    continue
+
+                # Swaps places with another robot
+                if offset:
+                    other = owners.get(key - rn)
+                    if other is not None and other != owner and owners.get(swap_key) == other:
+                        if count:
+                            n_rejected += 1
+                        continue
+
+                child = base + neighbor
+                g_child = g_cur + cost
+                if child in closed:
+                    if not bounded or g_child >= g[child]:
+                        continue
+                    closed.discard(child)
+                elif g_child >= g.get(child, inf):
+                    continue
+                h = h_field[neighbor]
+                if h == inf:
+                    continue
+
+                g[child] = g_child
+                parent[child] = state
+                heapq.heappush(open_list, (g_child + epsilon * (h if h > wait_left else wait_left), child))
+
+        # Every node pushed was either popped (closed or skipped) or is still open
+        self.expanded = n_closed
+        self.generated = n_closed + n_skipped + len(open_list) if count else 0
+        self.peak_open = peak_open
+        self.rejected = n_rejected
+        self.lower_bound = None
+        if bounded and goal_state is not None:
+            self.lower_bound = min([g[goal_state]] +
+                                   [g[s] + max(h_field[s % n], end_time - start_time - s // n)
+                                    for _, s in open_list if s not in closed])
+
+        if goal_state is None and pruner is not None and n_closed <= max_closed:
+            # Pruning can hide the detours some reservations force, so try again in full
+            self.pruner = None
+            path = self.search(start_id, goal_id, start_time, end_time, model, h_field, owner,
+                               max_closed - n_closed, epsilon, deadline)
+            self.pruner = pruner
+            self.expanded += n_closed
+            return path
+
+        return None if goal_state is None else self.backtrack(goal_state, parent)
+
+    def backtrack(self, state, parent):
+        n = self.graph.n_cells
+        path = []
+        while state != -1:
+            path.append(state % n)
+            state = parent[state]
+        return path[::-1]
@@ -0,0 +1,137 @@
+from utils import *
+from grid_search import *
+from collections import OrderedDict
+import numpy as np
+import heapq
+
+class LocalField(dict):
+    """
+    Distance field that only covers part of the map, e.g. one cluster. Cells
+    it does not hold are unreachable.
+    """
+    def __missing__(self, cell_id):
+        return math.inf
+
+class DistanceFieldCache:
+    """
+    LRU cache of true-distance heuristic fields over a warehouse's static
+    occupancy matrix.
+
+    A field holds the cost of the cheapest shelf-avoiding path from every cell
+    to one goal cell for one motion model (math.inf if unreachable), as a flat
+    list indexed by GridGraph cell id. The "cost" metric uses the CA* step
+    cost and the "hops" metric counts timesteps. Pick and drop points come from a fixed
+    set, so the same few hundred goals are reused for every path planned in a
+    warehouse.
+    """
+
+    def __init__(self, graph, maxsize=256):
+        self.graph = graph
+        self.maxsize = maxsize
+        self.fields = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"DistanceFieldCache(size={len(self.fields)}, maxsize={self.maxsize}, hits={self.hits}, misses={self.misses})"
+
+    def get(self, goal_cell, path_type, metric="cost"):
+        """
+        Returns the distance field to goal_cell for the motion model of path_type.
+        """
+        key = (tuple(goal_cell), motion_model(path_type), metric)
+        return self.lookup(key, lambda: self.compute_field(*key))
+
+    def lookup(self, key, compute):
+        """
+        Returns the cached field for key, computing and caching it on a miss.
+        """
+        field = self.fields.get(key)
+        if field is not None:
+            self.hits += 1
+            self.fields.move_to_end(key)
+            return field
+
+        self.misses += 1
+        field = compute()
+        self.fields[key] = field
+        if len(self.fields) > self.maxsize:
+            self.fields.popitem(last=False)
+        return field
+
+    def local_field(self, goal_cell, path_type, bounds, metric="cost"):
+        """
+        Returns the distance field to goal_cell for paths that stay in bounds,
+        as a LocalField. Cached alongside the full fields.
+        """
+        model = motion_model(path_type)
+        key = (tuple(goal_cell), model, metric, bounds)
+        return self.lookup(key, lambda: LocalField(self.graph.dijkstra(self.graph.encode(goal_cell), model, bounds, metric)[0]))
+
+    def precompute(self, goal_cells, path_types=("Drone", "AMR")):
+        """
+        Fills the cache with the fields of the given goal cells, e.g. the cells
+        of the pick and drop points from WarehouseMap.generate_points().
+        """
+        for cell in goal_cells:
+            for path_type in path_types:
+                self.get(cell, path_type)
+
+    def route(self, start_cell, goal_cell, path_type):
+        """
+        Returns the GridGraph ids of a cheapest shelf-avoiding path from
+        start_cell to goal_cell, ignoring reservations, by descending the goal's
+        distance field. Returns None if the goal is unreachable.
+        """
+        field = self.get(goal_cell, path_type)
+        cell, goal_id = self.graph.encode(start_cell), self.graph.encode(goal_cell)
+        if field[cell] == math.inf:
+            return None
+
+        moves = self.graph.moves[motion_model(path_type)][1:]
+        path = [cell]
+        while cell != goal_id:
+            _, cell = min((cost + field[cell + offset], cell + offset) for offset, cost in moves)
+            path.append(cell)
+        return path
+
+    def as_array(self, field):
+        """
+        Returns a field as an array shaped like the occupancy matrix.
+        """
+        return np.array(field).reshape(self.graph.padded_shape)[1:-1, 1:-1, 1:-1]
+
+    def compute_field(self, goal_cell, model, metric="cost"):
+        """
+        Runs a backward Dijkstra search from goal_cell over the free cells of
+        the occupancy matrix. Moves are symmetric, so the cost to reach the
+        goal from a cell is the cost of reaching that cell from the goal.
+        """
+        field = [math.inf] * self.graph.n_cells
+        if not all(0 <= c < lim for c, lim in zip(goal_cell, self.graph.shape)):
+            return field
+        goal_id = self.graph.encode(goal_cell)
+        if self.graph.blocked[goal_id]:
+            return field
+
+        blocked = self.graph.blocked
+        moves = self.graph.moves[model][1:]
+        if metric == "hops":
+            moves = [(offset, 1) for offset, _ in moves]
+        field[goal_id] = 0.0
+        open_list = [(0.0, goal_id)]
+
+        while open_list:
+            d, cell = heapq.heappop(open_list)
+            if d > field[cell]:
+                continue
+            for offset, cost in moves:
+                neighbor = cell + offset
+                if blocked[neighbor]:
+                    continue
+                nd = d + cost
+                if nd < field[neighbor]:
+                    field[neighbor] = nd
+                    heapq.heappush(open_list, (nd, neighbor))
+
+        return field
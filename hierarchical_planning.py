@@ -0,0 +1,273 @@
+from utils import *
+from grid_search import *
+from heuristics import *
+import numpy as np
+import bisect
+import heapq
+
+class AbstractGraph:
+    """
+    HPA* abstraction of a warehouse for one motion model.
+
+    The map is cut into clusters along every shelf edge from
+    WarehouseMap.generate_zones(), which splits it into aisle segments, aisle
+    intersections and border strips (clusters that are all shelf are dropped).
+    Every connected opening between two neighbouring clusters gets one pair of
+    entrance cells, and the entrances of a cluster are linked by the cached
+    shortest paths between them inside the cluster.
+    """
+
+    def __init__(self, graph, model):
+        self.graph = graph
+        self.model = model
+
+        wh_map = graph.wh_map
+        occ = wh_map.occupancy_matrix
+        x_lim, y_lim, z_lim = graph.shape
+
+        x_cuts, y_cuts = {0, x_lim}, {0, y_lim}
+        for zone in wh_map.blocked_areas:
+            cell_zone = wh_map.zone_points_to_cells(zone)
+            x_cuts.update(min(max(x, 0), x_lim) for x in cell_zone.x_lims)
+            y_cuts.update(min(max(y, 0), y_lim) for y in cell_zone.y_lims)
+        self.x_cuts = sorted(x_cuts)
+        self.y_cuts = sorted(y_cuts)
+
+        # Cluster (i, j) covers ((x0, x1), (y0, y1), (z0, z1)) with exclusive upper limits
+        self.clusters = {}
+        for i in range(len(self.x_cuts) - 1):
+            for j in range(len(self.y_cuts) - 1):
+                bounds = ((self.x_cuts[i], self.x_cuts[i+1]), (self.y_cuts[j], self.y_cuts[j+1]), (0, z_lim))
+                if not occ[bounds[0][0]:bounds[0][1], bounds[1][0]:bounds[1][1]].all():
+                    self.clusters[(i, j)] = bounds
+
+        self.entrances = {key: [] for key in self.clusters}
+
+        # Abstract edges: cell id -> list of (cell id, cost, cached path or None, bounds to refine in)
+        self.edges = {}
+
+        self.make_entrances()
+        self.make_intra_edges()
+
+    def __repr__(self):
+        n_entrances = sum(len(entrances) for entrances in self.entrances.values())
+        return f"AbstractGraph(model={self.model}, clusters={len(self.clusters)}, entrances={n_entrances})"
+
+    def cluster_of(self, cell_id):
+        """
+        Returns the key of the cluster a cell is in, or None if it is in a shelf.
+        """
+        x, y, _ = self.graph.decode(cell_id)
+        key = (bisect.bisect_right(self.x_cuts, x) - 1, bisect.bisect_right(self.y_cuts, y) - 1)
+        return key if key in self.clusters else None
+
+    def make_entrances(self):
+        occ = self.graph.wh_map.occupancy_matrix
+
+        for key, bounds in self.clusters.items():
+            for axis in (0, 1):
+                other_key = (key[0] + 1, key[1]) if axis == 0 else (key[0], key[1] + 1)
+                if other_key not in self.clusters:
+                    continue
+
+                # Free cell pairs straddling the shared face, indexed by the face's two other axes
+                border = bounds[axis][1]
+                face_axes = [a for a in range(3) if a != axis]
+                (u0, u1), (v0, v1) = bounds[face_axes[0]], bounds[face_axes[1]]
+                near = np.take(occ, border - 1, axis=axis)[u0:u1, v0:v1]
+                far = np.take(occ, border, axis=axis)[u0:u1, v0:v1]
+                openings = set(zip(*np.nonzero(~near & ~far)))
+
+                # Moves of the motion model that stay on the face
+                face_moves = set((d[face_axes[0]], d[face_axes[1]]) for d in MOTION_DELTAS[self.model] if d[axis] == 0)
+
+                while openings:
+                    component = [openings.pop()]
+                    frontier = list(component)
+                    while frontier:
+                        u, v = frontier.pop()
+                        for du, dv in face_moves:
+                            if (u + du, v + dv) in openings:
+                                openings.remove((u + du, v + dv))
+                                component.append((u + du, v + dv))
+                                frontier.append((u + du, v + dv))
+
+                    # One entrance per opening, at the cell closest to its middle
+                    mid_u, mid_v = np.mean(component, axis=0)
+                    u, v = min(component, key=lambda c: (c[0] - mid_u) ** 2 + (c[1] - mid_v) ** 2)
+
+                    near_cell, far_cell = [0, 0, 0], [0, 0, 0]
+                    near_cell[axis], far_cell[axis] = border - 1, border
+                    near_cell[face_axes[0]] = far_cell[face_axes[0]] = int(u) + u0
+                    near_cell[face_axes[1]] = far_cell[face_axes[1]] = int(v) + v0
+                    near_id, far_id = self.graph.encode(near_cell), self.graph.encode(far_cell)
+
+                    self.entrances[key].append(near_id)
+                    self.entrances[other_key].append(far_id)
+
+                    both = tuple((min(lo, o_lo), max(hi, o_hi)) for (lo, hi), (o_lo, o_hi) in zip(bounds, self.clusters[other_key]))
+                    cost = step_cost((1, 0, 0))
+                    self.edges.setdefault(near_id, []).append((far_id, cost, [near_id, far_id], both))
+                    self.edges.setdefault(far_id, []).append((near_id, cost, [far_id, near_id], both))
+
+    def make_intra_edges(self):
+        for key, entrances in self.entrances.items():
+            bounds = self.clusters[key]
+            for entrance in entrances:
+                dist, parent = self.graph.dijkstra(entrance, self.model, bounds)
+                for other in entrances:
+                    if other != entrance and other in dist:
+                        self.edges[entrance].append((other, dist[other], self.graph.trace(parent, other), bounds))
+
+    def lower_bound(self, cell_a, cell_b):
+        """
+        Admissible estimate of the cost between two cells: every move covers
+        at most one cell along each axis and costs at least sqrt(2).
+        """
+        return max(abs(a - b) for a, b in zip(self.graph.decode(cell_a), self.graph.decode(cell_b))) * math.sqrt(2)
+
+    def find_route(self, start_id, goal_id):
+        """
+        Plans through the abstract graph, linking start_id and goal_id to the
+        entrances of their clusters.
+
+        Returns:
+            list: (from, to, cached path or None, bounds) legs from start_id to
+                goal_id, or None if the clusters are not connected
+        """
+        start_key, goal_key = self.cluster_of(start_id), self.cluster_of(goal_id)
+        if start_key is None or goal_key is None:
+            return None
+
+        start_dist, start_parent = self.graph.dijkstra(start_id, self.model, self.clusters[start_key])
+        goal_dist, goal_parent = self.graph.dijkstra(goal_id, self.model, self.clusters[goal_key])
+        goal_edges = {entrance: goal_dist[entrance] for entrance in self.entrances[goal_key] if entrance in goal_dist}
+
+        def neighbors(cell_id):
+            edges = self.edges.get(cell_id, [])
+            if cell_id == start_id:
+                edges = edges + [(entrance, start_dist[entrance], self.graph.trace(start_parent, entrance), self.clusters[start_key])
+                                 for entrance in self.entrances[start_key] if entrance in start_dist]
+            if cell_id in goal_edges:
+                edges = edges + [(goal_id, goal_edges[cell_id], None, self.clusters[goal_key])]
+            return edges
+
+        best = {start_id: 0.0}
+        parent = {start_id: None}
+        open_list = [(self.lower_bound(start_id, goal_id), start_id)]
+        closed = set()
+
+        while open_list:
+            _, cell_id = heapq.heappop(open_list)
+            if cell_id in closed:
+                continue
+            closed.add(cell_id)
+
+            if cell_id == goal_id:
+                legs = []
+                while parent[cell_id] is not None:
+                    prev, path, bounds = parent[cell_id]
+                    legs.append((prev, cell_id, path, bounds))
+                    cell_id = prev
+                return legs[::-1]
+
+            for neighbor, cost, path, bounds in neighbors(cell_id):
+                if best[cell_id] + cost < best.get(neighbor, math.inf):
+                    best[neighbor] = best[cell_id] + cost
+                    parent[neighbor] = (cell_id, path, bounds)
+                    heapq.heappush(open_list, (best[neighbor] + self.lower_bound(neighbor, goal_id), neighbor))
+
+        return None
+
+class HierarchicalPlanner:
+    """
+    HPA*-style planner: long queries are routed through an AbstractGraph of
+    the warehouse and each leg of the route is then refined with a
+    space-time search that stays inside its cluster. Cached intra-cluster
+    paths are reused as-is when no reservation blocks them. Queries within a
+    single cluster, and any leg that cannot be refined locally, fall back to a
+    full-resolution search.
+    """
+    # Goal fields are computed per leg rather than by PathPlanner
+    metric = None
+
+    def __init__(self, graph, reservations, record_stats=False):
+        self.graph = graph
+        self.reservations = reservations
+        self.heuristics = DistanceFieldCache(graph, maxsize=1024)
+        self.local_search = SpaceTimeAStar(graph, reservations, record_stats)
+        self.abstract_graphs = {}
+        self.expanded = 0
+        self.generated = 0
+        self.peak_open = 0
+        self.rejected = 0
+
+    def __repr__(self):
+        return f"HierarchicalPlanner({self.graph}, {list(self.abstract_graphs.values())})"
+
+    def abstract_graph(self, model):
+        if model not in self.abstract_graphs:
+            self.abstract_graphs[model] = AbstractGraph(self.graph, model)
+        return self.abstract_graphs[model]
+
+    def add_counters(self):
+        """
+        Adds the counters of the last local search to this query's totals.
+        """
+        self.expanded += self.local_search.expanded
+        self.generated += self.local_search.generated
+        self.peak_open = max(self.peak_open, self.local_search.peak_open)
+        self.rejected += self.local_search.rejected
+
+    def direct_search(self, start_id, goal_id, start_time, end_time, model, owner, budget):
+        field = self.heuristics.get(self.graph.decode(goal_id), model)
+        if field[start_id] == math.inf:
+            return None
+        path = self.local_search.search(start_id, goal_id, start_time, end_time, model, field, owner, **budget)
+        self.add_counters()
+        return path
+
+    def search(self, start_id, goal_id, start_time, end_time, model, h_field=None, owner=None, max_closed=math.inf,
+               epsilon=1.0, deadline=None):
+        """
+        Takes the same arguments as SpaceTimeAStar.search. h_field is not
+        used: every leg gets its own local field. The budget applies to each
+        local search.
+        """
+        budget = {"max_closed": max_closed, "epsilon": epsilon, "deadline": deadline}
+        self.expanded = self.generated = self.peak_open = self.rejected = 0
+        route = None
+        if model != "wait":
+            abstract = self.abstract_graph(model)
+            start_key, goal_key = abstract.cluster_of(start_id), abstract.cluster_of(goal_id)
+            if start_key != goal_key:
+                route = abstract.find_route(start_id, goal_id)
+
+        if route is None:
+            return self.direct_search(start_id, goal_id, start_time, end_time, model, owner, budget)
+
+        table_ids = self.graph.table_ids
+        path = [start_id]
+        t = start_time
+        for k, (leg_start, leg_goal, cached_path, bounds) in enumerate(route):
+            last_leg = k == len(route) - 1
+
+            leg = None
+            if cached_path is not None and not last_leg:
+                if not self.reservations.path_conflict([table_ids[c] for c in cached_path], t, owner):
+                    leg = cached_path
+            if leg is None:
+                field = self.heuristics.local_field(self.graph.decode(leg_goal), model, bounds)
+                leg = self.local_search.search(leg_start, leg_goal, t, end_time if last_leg else t,
+                                               model, field, owner, **budget)
+                self.add_counters()
+            if leg is None:
+                leg = self.direct_search(leg_start, goal_id, t, end_time, model, owner, budget)
+                if leg is None:
+                    return None
+                return path + leg[1:]
+
+            path.extend(leg[1:])
+            t += len(leg) - 1
+
+        return path
@@ -0,0 +1,306 @@
+from utils import *
+import heapq
+import time
+
+class LifelongAStar:
+    """
+    Lifelong Planning A* (LPA*) over (cell, timestep) states for one query.
+
+    States are encoded like SpaceTimeAStar's (layer * n_cells + cell_id). g and
+    rhs values are kept between calls to plan(), and reservation changes made
+    by other robots only re-open the states whose incoming moves they affect,
+    so a replan costs time proportional to the area that changed rather than a
+    fresh search. Finishing at the goal at any timestep from end_time on is
+    modeled as a zero-cost move to a virtual GOAL state.
+
+    Keys are sums of float move costs, so equal keys reached along different
+    paths can differ in the last bits. Keys within KEY_EPS of each other are
+    treated as equal, and every state whose key ties the GOAL's is expanded
+    before the search stops, leaving the states of the path consistent.
+    """
+    GOAL = -1
+    KEY_EPS = 1e-9
+
+    def __init__(self, graph, reservations, start_id, goal_id, start_time, end_time, model, h_field, owner=None,
+                 epsilon=1.0, record_stats=False):
+        self.graph = graph
+        self.reservations = reservations
+        self.query = (start_id, goal_id, start_time, end_time, model, epsilon)
+        self.start_id = start_id
+        self.goal_id = goal_id
+        self.start_time = start_time
+        self.end_time = end_time
+        self.h_field = h_field
+        self.owner = owner
+        self.epsilon = epsilon
+        self.record_stats = record_stats
+        self.expanded = 0
+        self.generated = 0
+        self.peak_open = 0
+        self.rejected = 0
+
+        self.moves = graph.moves[model]
+        self.move_costs = dict(self.moves)
+        self.g = {}
+        self.rhs = {start_id: 0.0}
+        self.open = {}
+        self.open_list = []
+        self.goal_states = set()
+        self.changed = set()
+
+        self.push(start_id)
+        reservations.subscribe(self.on_reservations_changed)
+
+    def __repr__(self):
+        return f"LifelongAStar(query={self.query}, owner={self.owner}, states={len(self.rhs)})"
+
+    def close(self):
+        self.reservations.unsubscribe(self.on_reservations_changed)
+
+    def on_reservations_changed(self, keys, owner):
+        """
+        Keeps the changed keys of other robots that affect a state this
+        search has generated, for apply_changes().
+        """
+        if owner == self.owner:
+            return
+        for key in keys:
+            if any(state in self.rhs for state in self.affected_states(key)):
+                self.changed.add(key)
+
+    def affected_states(self, key):
+        """
+        Returns the states whose incoming moves depend on a reservation key:
+        moving into its node or the cell's previous timestep (vertex and
+        lookahead rules), and swaps through it.
+        """
+        n = self.graph.n_cells
+        t, table_id = divmod(key, self.reservations.n_cells)
+        cell = self.graph.graph_ids[table_id]
+        layer = t - self.start_time
+        states = [(layer + dt) * n + cell for dt in (-1, 0, 1)]
+        states.extend(layer * n + cell + offset for offset, _ in self.moves)
+        return states
+
+    def h(self, state):
+        if state == self.GOAL:
+            return 0.0
+        layer, cell = divmod(state, self.graph.n_cells)
+        return self.epsilon * max(self.h_field[cell], self.end_time - self.start_time - layer)
+
+    def key(self, state):
+        best = min(self.g.get(state, math.inf), self.rhs.get(state, math.inf))
+        return (best + self.h(state), best)
+
+    def push(self, state):
+        key = self.key(state)
+        self.open[state] = key
+        heapq.heappush(self.open_list, (key, state))
+        if self.record_stats:
+            self.generated += 1
+            self.peak_open = max(self.peak_open, len(self.open))
+
+    def key_leq(self, a, b):
+        """
+        Returns True if key a is at most key b, up to KEY_EPS.
+        """
+        if abs(a[0] - b[0]) <= self.KEY_EPS:
+            return a[1] <= b[1] + self.KEY_EPS
+        return a[0] < b[0]
+
+    def top_key(self):
+        while self.open_list:
+            key, state = self.open_list[0]
+            if self.open.get(state) == key:
+                return key
+            heapq.heappop(self.open_list)
+        return (math.inf, math.inf)
+
+    def cost(self, pred, state):
+        """
+        Returns the cost of the move from pred to state one timestep later, or
+        math.inf if it is blocked by a shelf, a reservation or a swap.
+        """
+        n = self.graph.n_cells
+        layer, cell = divmod(state, n)
+        pred_cell = pred % n
+        if self.graph.blocked[cell]:
+            return math.inf
+
+        table_ids = self.graph.table_ids
+        owners, rn = self.reservations.owners, self.reservations.n_cells
+        t = self.start_time + layer
+        key = t * rn + table_ids[cell]
+        if (key in owners or key + rn in owners or
+                self.reservations.edge_conflict(table_ids[pred_cell], table_ids[cell], t - 1, self.owner)):
+            if self.record_stats:
+                self.rejected += 1
+            return math.inf
+
+        return self.move_costs.get(cell - pred_cell, math.inf)
+
+    def predecessors(self, state):
+        n = self.graph.n_cells
+        layer, cell = divmod(state, n)
+        if layer == 0:
+            return []
+        return [(layer - 1) * n + cell - offset for offset, _ in self.moves if not self.graph.blocked[cell - offset]]
+
+    def successors(self, state):
+        if state == self.GOAL:
+            return []
+        n = self.graph.n_cells
+        layer, cell = divmod(state, n)
+        return [(layer + 1) * n + cell + offset for offset, _ in self.moves if not self.graph.blocked[cell + offset]]
+
+    def is_goal_state(self, state):
+        layer, cell = divmod(state, self.graph.n_cells)
+        return cell == self.goal_id and self.start_time + layer >= self.end_time
+
+    def update_state(self, state):
+        if state == self.GOAL:
+            self.rhs[state] = min((self.g.get(s, math.inf) for s in self.goal_states), default=math.inf)
+        elif state != self.start_id:
+            # Predecessors without g cannot lower rhs, so their moves are not costed
+            self.rhs[state] = min((self.g[p] + self.cost(p, state) for p in self.predecessors(state) if p in self.g),
+                                  default=math.inf)
+        self.open.pop(state, None)
+        if self.g.get(state, math.inf) != self.rhs.get(state, math.inf):
+            self.push(state)
+
+    def apply_changes(self):
+        """
+        Re-opens the states affected by the changed nodes.
+        """
+        n = self.graph.n_cells
+        affected = set()
+        for key in self.changed:
+            affected.update(self.affected_states(key))
+        self.changed = set()
+
+        # Every successor of an expanded state is in rhs, blocked or not
+        for state in affected:
+            if state >= n and state in self.rhs:
+                self.update_state(state)
+
+    def plan(self, max_closed=math.inf, deadline=None):
+        """
+        Repairs the search after any reservation changes and returns the
+        GridGraph ids of the cell at every timestep of the cheapest path, or
+        None if none was found within max_closed expansions or by deadline.
+        """
+        self.expanded = self.generated = self.peak_open = self.rejected = 0
+        self.apply_changes()
+
+        while (self.key_leq(self.top_key(), self.key(self.GOAL)) or
+               self.rhs.get(self.GOAL, math.inf) != self.g.get(self.GOAL, math.inf)):
+            if not self.open_list:
+                return None
+            if self.open_list[0][1] != self.GOAL:
+                if self.expanded > max_closed:
+                    return None
+                if deadline is not None and not self.expanded & 1023 and time.perf_counter() > deadline:
+                    return None
+                self.expanded += 1
+            _, state = heapq.heappop(self.open_list)
+            del self.open[state]
+
+            g_state = self.g.get(state, math.inf)
+            if g_state > self.rhs[state]:
+                # Overconsistent: settle g and relax the moves out of state
+                self.g[state] = g_state = self.rhs[state]
+                for succ in self.successors(state):
+                    new_rhs = g_state + self.cost(state, succ)
+                    if new_rhs < self.rhs.get(succ, math.inf):
+                        self.rhs[succ] = new_rhs
+                        self.open.pop(succ, None)
+                        if self.g.get(succ, math.inf) != new_rhs:
+                            self.push(succ)
+                    elif succ not in self.rhs:
+                        # Blocked for now, kept so that changes freeing it are not filtered out
+                        self.rhs[succ] = math.inf
+            else:
+                # Underconsistent: forget g and recompute everything that depended on it
+                self.g[state] = math.inf
+                self.update_state(state)
+                for succ in self.successors(state):
+                    self.update_state(succ)
+
+            if state != self.GOAL and self.is_goal_state(state):
+                self.goal_states.add(state)
+                self.update_state(self.GOAL)
+
+        return self.backtrack()
+
+    def is_consistent(self, state):
+        g = self.g.get(state, math.inf)
+        return g != math.inf and g == self.rhs.get(state, math.inf)
+
+    def backtrack(self):
+        """
+        Walks back from the cheapest goal state through consistent
+        predecessors, returning None if the chain breaks before the start.
+        """
+        goal_states = [s for s in self.goal_states if self.is_consistent(s)]
+        if self.g.get(self.GOAL, math.inf) == math.inf or not goal_states:
+            return None
+        state = min(goal_states, key=lambda s: self.g[s])
+
+        n = self.graph.n_cells
+        path = [state % n]
+        while state != self.start_id:
+            parents = [(self.g[p] + self.cost(p, state), p) for p in self.predecessors(state) if self.is_consistent(p)]
+            if not parents or min(parents)[0] == math.inf:
+                return None
+            state = min(parents)[1]
+            path.append(state % n)
+        return path[::-1]
+
+class IncrementalPlanner:
+    """
+    Keeps one LifelongAStar per robot. Asking again for the same query, e.g.
+    through PathPlanner.replan(), repairs the robot's previous search instead
+    of starting over; a new query replaces it, and finish() drops it.
+    """
+    metric = "cost"
+
+    def __init__(self, graph, reservations, record_stats=False):
+        self.graph = graph
+        self.reservations = reservations
+        self.record_stats = record_stats
+        self.searches = {}
+        self.expanded = 0
+        self.generated = 0
+        self.peak_open = 0
+        self.rejected = 0
+
+    def __repr__(self):
+        return f"IncrementalPlanner({self.graph}, robots={len(self.searches)})"
+
+    def search(self, start_id, goal_id, start_time, end_time, model, h_field, owner=None, max_closed=math.inf,
+               epsilon=1.0, deadline=None):
+        """
+        Takes the same arguments as SpaceTimeAStar.search. A search is only
+        reused for the same epsilon.
+        """
+        search = self.searches.get(owner)
+        if search is None or search.query != (start_id, goal_id, start_time, end_time, model, epsilon):
+            if search is not None:
+                search.close()
+            search = LifelongAStar(self.graph, self.reservations, start_id, goal_id, start_time, end_time,
+                                   model, h_field, owner, epsilon, self.record_stats)
+            self.searches[owner] = search
+        path = search.plan(max_closed, deadline)
+        self.expanded, self.generated = search.expanded, search.generated
+        self.peak_open, self.rejected = search.peak_open, search.rejected
+        return path
+
+    def finish(self, owner):
+        """
+        Drops the search kept for a robot, e.g. once it has no legs left to
+        plan, so that it stops following reservation changes. A later
+        replan() of its last query starts a new search.
+        """
+        search = self.searches.pop(owner, None)
+        if search is not None:
+            search.close()
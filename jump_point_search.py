@@ -0,0 +1,114 @@
+from utils import *
+from grid_search import *
+import numpy as np
+import itertools
+import bisect
+
+class JumpPointPruner:
+    """
+    Jump Point Search style successor pruning for drones in SpaceTimeAStar.
+
+    A state reached by moving d from its parent only needs the successors
+    that cannot be reached from the parent at the same timestep by a strictly
+    cheaper two-step path avoiding the state, since any path through the
+    pruned successor can be shortened. Which successors survive only depends
+    on d and on which of the 26 neighbours are shelves, so the rules are
+    computed once per (direction, neighbourhood mask) and cached.
+
+    The cheaper paths avoid shelves but not reservations, so states that have
+    a reservation within their 3x3x3 neighbourhood around the current
+    timestep are expanded in full. SpaceTimeAStar repeats a pruned search
+    that fails without pruning.
+    """
+
+    def __init__(self, graph, reservations, model="drone"):
+        self.graph = graph
+        self.reservations = reservations
+        self.model = model
+        self.deltas = [(0, 0, 0)] + MOTION_DELTAS[model]
+        self.moves = dict(zip(self.deltas, graph.moves[model]))
+        self.cube = [graph.offset(d) for d in itertools.product([-1, 0, 1], repeat=3)]
+        self.rules = {}
+        self.near = {}
+        self.masks = self.make_masks()
+
+    def __repr__(self):
+        return f"JumpPointPruner(model={self.model}, rules={len(self.rules)})"
+
+    def make_masks(self):
+        """
+        Returns, for every GridGraph cell, a bit mask of which neighbour
+        deltas of the motion model lead into a shelf or off the map.
+        """
+        blocked = np.pad(np.array(self.graph.blocked).reshape(self.graph.padded_shape), 1, constant_values=True)
+        x_lim, y_lim, z_lim = self.graph.padded_shape
+        masks = np.zeros(self.graph.padded_shape, dtype=np.int64)
+        for bit, (dx, dy, dz) in enumerate(self.deltas[1:]):
+            shifted = blocked[1+dx:1+dx+x_lim, 1+dy:1+dy+y_lim, 1+dz:1+dz+z_lim]
+            masks |= shifted.astype(np.int64) << bit
+        return masks.ravel().tolist()
+
+    def reset(self):
+        """
+        Forgets the reservations seen near each cell; called at the start of
+        every query.
+        """
+        self.near = {}
+
+    def near_reservation(self, cell, t):
+        """
+        Returns True if any cell of the 3x3x3 cube around cell is reserved
+        between timesteps t-1 and t+2.
+        """
+        times = self.near.get(cell)
+        if times is None:
+            cell_times = self.reservations.cell_times
+            table_ids = self.graph.table_ids
+            times = sorted(time for offset in self.cube
+                           for time in cell_times.get(table_ids[cell + offset], ()))
+            self.near[cell] = times
+        i = bisect.bisect_left(times, t - 1)
+        return i < len(times) and times[i] <= t + 2
+
+    def successors(self, cell, parent_cell, t):
+        """
+        Returns the (offset, cost) moves worth generating from cell at
+        timestep t, or None to generate them all.
+        """
+        offset = cell - parent_cell
+        if not offset or self.near_reservation(cell, t):
+            return None
+        key = (offset, self.masks[cell])
+        moves = self.rules.get(key)
+        if moves is None:
+            moves = self.make_rule(offset, self.masks[cell])
+            self.rules[key] = moves
+        return moves
+
+    def make_rule(self, offset, mask):
+        d = next(delta for delta in self.deltas if self.graph.offset(delta) == offset)
+        blocked = {delta for bit, delta in enumerate(self.deltas[1:]) if mask >> bit & 1}
+        parent = tuple(-c for c in d)
+
+        moves = []
+        for e in self.deltas:
+            if e in blocked:
+                continue
+            via_cost = step_cost(d) + step_cost(e)
+
+            # Look for a strictly cheaper two-step path from the parent to e that avoids the cell
+            pruned = False
+            for a in self.deltas:
+                y = tuple(ai + pi for ai, pi in zip(a, parent))
+                if y == (0, 0, 0) or max(map(abs, y)) > 1 or (y != parent and y in blocked):
+                    continue
+                b = tuple(ei - yi for ei, yi in zip(e, y))
+                if max(map(abs, b)) > 1:
+                    continue
+                if step_cost(a) + step_cost(b) < via_cost - 1e-9:
+                    pruned = True
+                    break
+
+            if not pruned:
+                moves.append(self.moves[e])
+        return moves
@@ -28,6 +28,11 @@ evaluator.set_static("n_amr", 2)
 
 visualizer_info = []
 master_dists = []
+
+# Static routes are keyed by map fingerprint, so one cache serves every sweep iteration
+path_cache = PathCache()
+# Clusterings are keyed by the task coordinates, so fleet compositions sharing a task list cluster it once
+cluster_cache = ClusterCache()
 for i, wh_info in enumerate(evaluator.generate_wh_info()):
     # Initialize a warehouse and pick and drop points
     wh_map = WarehouseMap(wh_info, resolution=0.1, units="ft")
@@ -57,11 +62,13 @@ for i, wh_info in enumerate(evaluator.generate_wh_info()):
         
         task_allocator = TaskAllocator(task_list, fleet, wh_map.resolution,
                                     region_type="sized_regions",
-                                    handoff_type="closest2drop_handoff")
+                                    handoff_type="closest2drop_handoff",
+                                    cluster_cache=cluster_cache,
+                                    points=wh_map.points)
 
         task_allocator.cluster_regions()
 
-        path_planner = PathPlanner(wh_map, fleet)
+        path_planner = PathPlanner(wh_map, fleet, path_cache=path_cache)
 
         for i, r in enumerate(task_allocator.regions):
             print("="*30, f"Planning region {i}/{len(task_allocator.regions)}")
@@ -0,0 +1,232 @@
+from utils import *
+from grid_search import *
+
+class ConstraintNode:
+    """
+    Node of the CBS constraint tree: the constraints of every agent and the
+    paths planned under them.
+    """
+
+    def __init__(self, constraints, paths, costs, lower_bounds, conflicts):
+        self.constraints = constraints
+        self.paths = paths
+        self.costs = costs
+        self.cost = sum(costs)
+        # Sum of the low-level lower bounds on each agent's optimal cost under its constraints
+        self.lower_bounds = lower_bounds
+        self.lower_bound = sum(lower_bounds)
+        self.n_conflicts = len(conflicts)
+        self.conflict = min(conflicts) if conflicts else None
+
+    def __repr__(self):
+        return f"ConstraintNode(cost={self.cost:.2f}, conflicts={self.n_conflicts})"
+
+class ConflictBasedSearch:
+    """
+    Conflict-Based Search (CBS) over a set of queries planned at the same
+    time, e.g. the next leg of every robot in a region.
+
+    Every agent is planned on its own around the existing reservations. The
+    first conflict between two of the paths then splits the search: one
+    child forbids the first robot from the node the second occupies, the
+    other child does the opposite, and only the constrained robot is
+    replanned. Conflicts use the same vertex and lookahead rules as CA*: two
+    robots may not be in a cell at timesteps less than two apart, which also
+    rules out swaps.
+
+    A robot's next leg starts a timestep after its path ends, and a drone's
+    wait leg can be a single cell, so a robot stays at the end of its path
+    for up to HOLD more timesteps, planned in later rounds where no search
+    checks them. The low-level search only ends at a goal that is free for
+    those timesteps, and another robot visiting the cell while it is held
+    is a conflict too, which splits on the visiting robot only, or on the
+    parked one if the visit is the other robot's start. Starts are checked
+    against the other paths, but two starts in conflict cannot be moved and
+    are left alone. PathPlanner reserves the held timesteps once the paths
+    are committed, for the rounds after.
+
+    With suboptimality > 1 this is ECBS. Low-level paths come from weighted
+    A* (with reopening, instead of a focal search) and cost at most
+    suboptimality times the agent's optimum under its constraints. Each
+    search also reports a lower bound on that optimum: the smallest
+    unweighted f left in its open list. A node's lower bound is the sum over
+    its agents. The next node to split is the one with the fewest conflicts
+    among those costing at most suboptimality times the smallest lower bound
+    of the open nodes, so the total cost returned is at most suboptimality
+    times the optimum.
+
+    The low-level counters of solve() are kept in total and, in
+    agent_counters, for the searches of each agent's owner.
+    """
+    # Owner of the reservations standing in for constraints during a low-level search
+    CONSTRAINT = "CBS constraint"
+    # Timesteps a robot stays at the end of its path before its next leg can move it
+    HOLD = 2
+
+    def __init__(self, graph, reservations, suboptimality=1.0, max_nodes=256, record_stats=False):
+        self.graph = graph
+        self.reservations = reservations
+        self.suboptimality = suboptimality
+        self.max_nodes = max_nodes
+        self.low_level = SpaceTimeAStar(graph, reservations, record_stats)
+        self.low_level.bounded = suboptimality > 1
+        self.low_level.goal_hold = self.HOLD
+
+        self.nodes = 0
+        self.expanded = 0
+        self.generated = 0
+        self.peak_open = 0
+        self.rejected = 0
+        self.agent_counters = {}
+
+    def __repr__(self):
+        name = "ECBS" if self.suboptimality > 1 else "CBS"
+        return f"ConflictBasedSearch({name}, suboptimality={self.suboptimality}, max_nodes={self.max_nodes})"
+
+    def plan_agent(self, query, constraints):
+        """
+        Plans one agent with its constraints reserved in the reservation
+        table. A constraint (cell_id, t) keeps the agent out of the cell from
+        timestep t-1 to t+1. The agent holds its goal once there, so a
+        constraint on the goal also keeps it from arriving before t+2.
+
+        Returns:
+            tuple: (path, cost, lower bound on the optimal cost), or
+                (None, None, None) if no path was found
+        """
+        start_id, goal_id, start_time, end_time, model, h_field, owner, max_closed = query
+        table_ids = self.graph.table_ids
+        end_time = max([end_time] + [t + 2 for cell_id, t in constraints if cell_id == goal_id])
+
+        added = []
+        for cell_id, t in constraints:
+            for node_t in (t, t + 1):
+                if not self.reservations.is_reserved(table_ids[cell_id], node_t):
+                    self.reservations.reserve(table_ids[cell_id], node_t, self.CONSTRAINT)
+                    added.append((table_ids[cell_id], node_t))
+
+        path = self.low_level.search(start_id, goal_id, start_time, end_time, model, h_field, owner,
+                                     max_closed, self.suboptimality)
+
+        for table_id, t in added:
+            self.reservations.release(table_id, t, self.CONSTRAINT)
+
+        self.expanded += self.low_level.expanded
+        self.generated += self.low_level.generated
+        self.peak_open = max(self.peak_open, self.low_level.peak_open)
+        self.rejected += self.low_level.rejected
+        counters = self.agent_counters.setdefault(owner, dict.fromkeys(("expanded", "generated", "peak_open",
+                                                                         "rejected"), 0))
+        counters["expanded"] += self.low_level.expanded
+        counters["generated"] += self.low_level.generated
+        counters["peak_open"] = max(counters["peak_open"], self.low_level.peak_open)
+        counters["rejected"] += self.low_level.rejected
+        if path is None:
+            return None, None, None
+        cost = self.graph.path_cost(path)
+        lower_bound = cost if self.low_level.lower_bound is None else self.low_level.lower_bound
+        return path, cost, lower_bound
+
+    def find_conflicts(self, queries, paths):
+        """
+        Returns every conflict between two paths as (t, agent, k, other, k_other):
+        agent is at its k-th cell at timestep t and other is in the same cell
+        at its k_other-th, at timestep t or t+1. A k of -1 means agent holds
+        the end of its path and other is there at timestep t.
+        """
+        occupied = {}
+        visits = {}
+        for agent, (query, path) in enumerate(zip(queries, paths)):
+            start_time = query[2]
+            for k, cell in enumerate(path):
+                occupied.setdefault((cell, start_time + k), []).append((agent, k))
+                visits.setdefault(cell, []).append((start_time + k, agent, k))
+
+        conflicts = []
+        for (cell, t), users in occupied.items():
+            for dt in (0, 1):
+                for agent, k in users:
+                    for other, k_other in occupied.get((cell, t + dt), ()):
+                        if agent == other or (dt == 0 and other < agent):
+                            continue
+                        # Neither start can be moved
+                        if k == 0 and k_other == 0:
+                            continue
+                        conflicts.append((t, agent, k, other, k_other))
+
+        # Visits to a held cell later than the lookahead rule above covers
+        for agent, (query, path) in enumerate(zip(queries, paths)):
+            arrival = query[2] + len(path) - 1
+            for t, other, k_other in visits[path[-1]]:
+                if other != agent and arrival + 1 < t <= arrival + self.HOLD + 1:
+                    # A start cannot be moved, so the parked robot has to arrive later instead
+                    k = len(path) - 1 if k_other == 0 else -1
+                    conflicts.append((t, agent, k, other, k_other))
+        return conflicts
+
+    def make_node(self, queries, constraints, paths, costs, lower_bounds):
+        return ConstraintNode(constraints, paths, costs, lower_bounds, self.find_conflicts(queries, paths))
+
+    def select(self, open_nodes):
+        """
+        Pops the cheapest node for CBS, or the node with the fewest conflicts
+        in the focal list for ECBS.
+        """
+        if self.suboptimality > 1:
+            best = min(open_nodes, key=lambda node: node.lower_bound)
+            bound = self.suboptimality * best.lower_bound
+            focal = [node for node in open_nodes if node is best or node.cost <= bound]
+            node = min(focal, key=lambda node: (node.n_conflicts, node.cost))
+        else:
+            node = min(open_nodes, key=lambda node: (node.cost, node.n_conflicts))
+        open_nodes.remove(node)
+        return node
+
+    def solve(self, queries):
+        """
+        Plans all queries without conflicts between them.
+
+        Args:
+            queries (list): (start_id, goal_id, start_time, end_time, model,
+                h_field, owner, max_closed) of every agent, as taken by
+                SpaceTimeAStar.search
+
+        Returns:
+            list: GridGraph ids of the cell at every timestep for each query,
+                or None if no solution was found within max_nodes splits
+        """
+        self.nodes = self.expanded = self.generated = self.peak_open = self.rejected = 0
+        self.agent_counters = {}
+
+        constraints = [frozenset()] * len(queries)
+        plans = [self.plan_agent(query, ()) for query in queries]
+        if any(path is None for path, _, _ in plans):
+            return None
+        paths, costs, lower_bounds = (list(column) for column in zip(*plans))
+        open_nodes = [self.make_node(queries, constraints, paths, costs, lower_bounds)]
+
+        while open_nodes and self.nodes < self.max_nodes:
+            node = self.select(open_nodes)
+            if node.conflict is None:
+                return node.paths
+            self.nodes += 1
+
+            t, agent, k, other, k_other = node.conflict
+            cell = node.paths[agent][k]
+            branches = []
+            if k > 0:
+                branches.append((agent, (cell, queries[other][2] + k_other)))
+            if k_other > 0:
+                branches.append((other, (cell, t)))
+
+            for constrained, constraint in branches:
+                constraints = list(node.constraints)
+                constraints[constrained] = constraints[constrained] | {constraint}
+                path, cost, lower_bound = self.plan_agent(queries[constrained], constraints[constrained])
+                if path is None:
+                    continue
+                paths, costs, lower_bounds = list(node.paths), list(node.costs), list(node.lower_bounds)
+                paths[constrained], costs[constrained], lower_bounds[constrained] = path, cost, lower_bound
+                open_nodes.append(self.make_node(queries, constraints, paths, costs, lower_bounds))
+
+        return None
@@ -0,0 +1,51 @@
+class PathCache:
+    """
+    Cache of static shortest routes between cells, keyed by
+    (start cell, goal cell, motion model, map fingerprint).
+
+    A route ignores reservations, so it is only a candidate: PathPlanner
+    checks it against the reservation table at the requested start time and
+    falls back to a full search when it conflicts. The map fingerprint in the
+    key lets one cache be shared by every PathPlanner built over maps with
+    the same layout, e.g. across the regions, fleet compositions and sweep
+    iterations of main.py.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+
+    def __repr__(self):
+        return (f"PathCache(size={len(self.routes)}, hits={self.hits}, " +
+                f"misses={self.misses}, conflicts={self.conflicts})")
+
+    def __len__(self):
+        return len(self.routes)
+
+    def get(self, key, compute):
+        """
+        Returns the cached route for key, computing and caching it on a miss.
+        Unreachable goals are cached as None.
+        """
+        if key in self.routes:
+            self.hits += 1
+            return self.routes[key]
+
+        self.misses += 1
+        route = compute()
+        self.routes[key] = route
+        return route
+
+    def stats(self):
+        """
+        Returns the hit, miss and conflict counters as a dict.
+        """
+        return {"hits": self.hits, "misses": self.misses, "conflicts": self.conflicts}
+
+    def clear(self):
+        self.routes = {}
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
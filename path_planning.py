@@ -1,184 +1,324 @@
 from utils import *
 from warehouse_map import *
 from robot_fleet import *
+from reservation_table import ReservationTable
+from grid_search import *
+from heuristics import *
+from sipp import SafeIntervalPlanner
+from hierarchical_planning import HierarchicalPlanner
+from incremental_planning import IncrementalPlanner
+from path_cache import PathCache
+from planner_stats import PlannerStats
+from multi_agent_planning import ConflictBasedSearch
+from jump_point_search import JumpPointPruner
 import numpy as np
-import heapq
-import itertools
 import math
-
-class Node:
-    """
-    A node class for CA* Pathfinding
-    """
-
-    def __init__(self, position=None, parent=None):
-        self.position = position
-        self.parent = parent
-
-        self.g = 0
-        self.h = 0
-        self.f = 0
-
-    def get_position(self): return self.position
-
-    def set_position(self, value): self.position = value
-
-    def get_parent(self): return self.parent
-
-    def set_parent(self, value): self.parent = value
-
-    def get_g(self): return self.g
-
-    def set_g(self, value):
-        self.g = value
-        self.update_f()
-
-    def get_h(self): return self.h
-
-    def set_h(self, value):
-        self.h = value
-        self.update_f()
-
-    def get_f(self): return self.f
-
-    def update_f(self): self.f = self.g + self.h
-
-    def is_valid_end(self, end):
-        valid_pos = self.position[:-1] == end.position[:-1]
-        valid_time = self.position[-1] >= end.position[-1]
-        return valid_pos and valid_time
-
-    def __eq__(self, other) -> bool:
-        return self.position == other.position
-    
-    def __ne__(self, other) -> bool:
-        return not self.__eq__(other)
-    
-    def __hash__(self) -> int:
-        return hash(self.position)
-    
-    def __repr__(self) -> str:
-      return f"{self.position} - g: {self.g} h: {self.h} f: {self.f}"
-
-    # defining less than for purposes of heap queue
-    def __lt__(self, other):
-      return self.f < other.f
-    
-    # defining greater than for purposes of heap queue
-    def __gt__(self, other):
-      return self.f > other.f
+import time
 
 class PathPlanner:
-    def __init__(self, map, fleet):
+    # Heuristic inflation below which an anytime search goes straight to epsilon 1.0
+    MIN_INFLATION = 0.05
+
+    def __init__(self, map, fleet, search_type="ca_star", path_cache=None,
+                 max_expansions=None, time_limit=None, epsilon=1.0, anytime=False, record_stats=False,
+                 region_planner="sequential", suboptimality=1.5, jump_point_search=False):
+        """
+        Args:
+            map (WarehouseMap): warehouse to plan in
+            fleet (Fleet): robots to plan for
+            search_type (str, optional): Defaults to "ca_star".
+                "ca_star" - A* over (cell, timestep) states
+                "sipp" - Safe Interval Path Planning over (cell, safe interval)
+                    states, much faster for long waits
+                "hierarchical" - HPA*-style routing over aisle clusters,
+                    refined locally, for long cross-warehouse queries
+                "incremental" - LPA* that keeps each robot's search and
+                    repairs it on replan()
+            path_cache (PathCache, optional): static routes to try before
+                searching, shared with other planners. A cached route is only
+                used if no reservation is in its way, when it is also the
+                path CA* would find, so the cache is only used by search_type
+                "ca_star". Defaults to None, always searching.
+            max_expansions (int, optional): expansions after which a query
+                fails. Defaults to the size of the space-time box spanned by
+                the query.
+            time_limit (float, optional): seconds after which a query fails.
+                Defaults to no limit.
+            epsilon (float, optional): heuristic weight, returning paths at
+                most epsilon times the optimal cost. Defaults to 1.0.
+            anytime (bool, optional): if True, search again with a smaller
+                epsilon after every path found, down to 1.0, and keep the best
+                path found within the budget. Defaults to False.
+            record_stats (bool, optional): if True, record every query in
+                self.stats, a PlannerStats. Defaults to False.
+            region_planner (str, optional): Defaults to "sequential".
+                "sequential" - plan_next_region plans one robot after another
+                "cbs" - plans the robots of a region together with
+                    Conflict-Based Search, one leg per robot per round
+                "ecbs" - bounded-suboptimal CBS, within suboptimality times
+                    the optimal total cost
+            suboptimality (float, optional): bound for "ecbs". Defaults to 1.5.
+            jump_point_search (bool, optional): if True, prune symmetric
+                drone successors JPS-style. Only used by search_type
+                "ca_star". Defaults to False.
+
+        Any of the budget arguments can be overridden per query in calc_ca_star_path.
+        """
         self.map = map
         self.fleet = fleet
-        self.occupied_nodes = set()
+        self.reservations = ReservationTable(map.occupancy_matrix.shape)
+        self.graph = GridGraph(map)
+        self.heuristics = DistanceFieldCache(self.graph)
+        self.path_cache = path_cache if search_type == "ca_star" else None
+        self.map_fingerprint = map.fingerprint()
+        self.search_type = search_type
+        self.budget = {"max_expansions": max_expansions, "time_limit": time_limit,
+                       "epsilon": epsilon, "anytime": anytime}
+
+        search_options = {
+            "ca_star" :     SpaceTimeAStar,
+            "sipp" :        SafeIntervalPlanner,
+            "hierarchical" : HierarchicalPlanner,
+            "incremental" : IncrementalPlanner
+        }
+
+        # Engines only count generated nodes, open-list peaks and rejections when stats are recorded
+        self.search = search_options[search_type](self.graph, self.reservations, record_stats=record_stats)
+        if jump_point_search and search_type == "ca_star":
+            self.search.pruner = JumpPointPruner(self.graph, self.reservations)
+
+        region_planner_options = {
+            "sequential" :  None,
+            "cbs" :         1.0,
+            "ecbs" :        suboptimality
+        }
+
+        self.region_planner = region_planner
+        self.joint_search = None
+        if region_planner_options[region_planner] is not None:
+            self.joint_search = ConflictBasedSearch(self.graph, self.reservations,
+                                                    region_planner_options[region_planner],
+                                                    record_stats=record_stats)
+
+        # Last query and path planned for each robot, for replan()
+        self.last_queries = {}
+        # (cell_id, t) nodes reserved for each robot at the end of its last jointly planned leg
+        self.holds = {}
+
+        self.stats = PlannerStats() if record_stats else None
+        self.region = None
+        self.regions_planned = 0
         
     def __repr__(self):
         pass
 
-    def backtrack_path(self, node):
-        path = []
-        cur_node = node
-        while cur_node is not None:
-            path.append(cur_node.get_position())
-            self.occupied_nodes.add(cur_node.get_position())
-            cur_node = cur_node.parent
-
-        return [self.map.cell_to_point_center(Cell(x, y, z)) for x,y,z,_ in path[::-1]]
+    def commit_path(self, cells, start_time, owner=None):
+        """
+        Reserves a path of cells starting at start_time and returns it as the
+        Points at the center of each cell.
+        """
+        self.reservations.reserve_path(cells, start_time, owner)
+        return [self.map.cell_to_point_center(Cell(x, y, z)) for x, y, z in cells]
     
-    def calc_ca_star_path(self, start: Point, end: Point, start_time: int, end_time: int, path_type: str, debug=False):
+    def calc_ca_star_path(self, start: Point, end: Point, start_time: int, end_time: int, path_type: str, debug=False, robot_id=None,
+                          **budget):
+        """
+        Plans a path from start to end that avoids shelves and the paths
+        already reserved by other robots, and reserves it.
+
+        Args:
+            start (Point): start location
+            end (Point): goal location
+            start_time (int): timestep the robot leaves start
+            end_time (int): earliest timestep the robot may finish at end
+            path_type (str): motion model, "D..." for drones, "W" for waiting
+                in place and anything else for AMRs
+            robot_id (str, optional): robot the path is reserved for. Defaults
+                to path_type.
+            **budget: max_expansions, time_limit, epsilon or anytime for this
+                query only, see __init__
+
+        Returns:
+            list: Points visited at each timestep from start_time on
+        """
+        owner = path_type if robot_id is None else robot_id
         start_cell = self.map.point_to_cell(start)
         end_cell = self.map.point_to_cell(end)
-
-        start_tuple = tuple(list(start_cell) + [start_time])
-        end_tuple = tuple(list(end_cell) + [end_time])
-        
-        start_node = Node(start_tuple)
-        end_node = Node(end_tuple)
-
+        start_id = self.graph.encode(start_cell)
+        end_id = self.graph.encode(end_cell)
+
+        if debug: print(f"Planning {path_type}: {(*start_cell, start_time)} --> {(*end_cell, end_time)}")
+
+        if self.stats is not None:
+            query_start = time.perf_counter()
+            self.query_counters = dict.fromkeys(("expanded", "generated", "peak_open", "rejected"), 0)
+
+        # Try the static route first, waiting at the goal until end_time
+        cell_path = None
+        if self.path_cache is not None:
+            cell_path = self.cached_path(start_cell, end_cell, start_time, end_time, path_type, owner)
+        source = "cache"
+        dist_field = None
+
+        if cell_path is None:
+            source = "search"
+
+            # Shelf-aware distance to the goal, raised to the number of timesteps left to wait
+            if self.search.metric is not None:
+                dist_field = self.heuristics.get(end_cell, path_type, self.search.metric)
+
+            budget = {**self.budget, **budget}
+            max_closed = self.expansion_budget(start_cell, end_cell, start_time, end_time, budget["max_expansions"])
+            deadline = None
+            if budget["time_limit"] is not None:
+                deadline = time.perf_counter() + budget["time_limit"]
+
+            if dist_field is None or dist_field[start_id] != math.inf:
+                cell_path = self.run_search(start_id, end_id, start_time, end_time, path_type, dist_field, owner,
+                                            max_closed, budget["epsilon"], deadline, budget["anytime"])
+
+        if self.stats is not None:
+            self.record_query(owner, path_type, start_id, start_time, end_time, source, cell_path, dist_field,
+                              time.perf_counter() - query_start)
+
+        if cell_path is None:
+            raise RuntimeError(f"{terminal_colors['FAIL']}" +
+                               f"No path found:\n\tPath Type: {path_type}"+
+                               f"\n\tCells: {start_cell} --> {end_cell}" +
+                               f"\n\tPoints: {start} --> {end}" +
+                               f"{terminal_colors['ENDC']}")
+
+        cells = [self.graph.decode(cell_id) for cell_id in cell_path]
+        self.last_queries[owner] = ((start, end, start_time, end_time, path_type), cells)
+        return self.commit_path(cells, start_time, owner)
+
+    def expansion_budget(self, start_cell, end_cell, start_time, end_time, max_expansions=None):
+        """
+        Returns max_expansions, or by default the size of the space-time box
+        spanned by the query.
+        """
+        if max_expansions is not None:
+            return max_expansions
         cityblock_estimate = sum(abs(x2-x1) for x1, x2 in zip(start_cell, end_cell))
+        return self.reservations.n_cells * (cityblock_estimate + abs(end_time - start_time))
 
-        if debug: print(f"Planning {path_type}: {start_tuple} --> {end_tuple}")
-
-        open_list = [start_node]
-        closed_set = set()
-
-        heapq.heapify(open_list)
-
-        if path_type.lower().startswith("w"):
-            adjacent_deltas = set(itertools.product([0], [0], [-1,0,1], [1]))
-        elif path_type.lower().startswith("d"):
-            adjacent_deltas = set(itertools.product([-1,0,1], [-1,0,1], [-1,0,1], [1]))
-        else:
-            adjacent = [(0,0), (1,0), (-1,0), (0,1), (0,-1)]
-            adjacent_deltas = set((x,y,0,1) for x,y in adjacent)
-
-        x_lim = self.map.wh_zone.x_lims[1] * self.map.resolution
-        y_lim = self.map.wh_zone.y_lims[1] * self.map.resolution
-        z_lim = self.map.wh_zone.z_lims[1] * self.map.resolution
-        
-
-        while len(open_list) > 0:
-            if len(closed_set) > x_lim * y_lim * z_lim * (cityblock_estimate + abs(end_time - start_time)):
-                raise RuntimeError(f"{terminal_colors['FAIL']}" +
-                                   f"No path found:\n\tPath Type: {path_type}"+
-                                   f"\n\tCells: {start_cell} --> {end_cell}" +
-                                   f"\n\tPoints: {start} --> {end}" +
-                                   f"{terminal_colors['ENDC']}")
-            
-            # Get the current node
-            cur_node = heapq.heappop(open_list)
-            closed_set.add(cur_node)
-
-            # If the goal is found
-            if cur_node.is_valid_end(end_node):
-                return self.backtrack_path(cur_node)
-            
-            # Generate children
-            children = []
-
-            for delta in adjacent_deltas:
-                neighbor = tuple(cur_node.get_position()[i] + delta[i] for i in range(len(cur_node.get_position())))
-
-                # Check if in range
-                lt_zero = [neighbor[i] < 0 for i in range(3)]
-                gt_lim = [neighbor[0] >= x_lim, neighbor[1] >= y_lim, neighbor[2] >= z_lim]
-                if True in lt_zero or True in gt_lim:
-                    continue
-
-                # Check if position collides with shelves or planned paths
-                cur_cell = Cell(neighbor[0], neighbor[1], neighbor[2])
-                lookahead = tuple(neighbor[i]+int(i==3) for i in range(len(neighbor)))
-                robot_to_robot_collision = [node in self.occupied_nodes for node in [neighbor, lookahead]]
-
-                if self.map.cell_blocked(cur_cell) or True in robot_to_robot_collision:
-                    continue
-
-                # Create and add new node to children
-                new_node = Node(neighbor, cur_node)
-                children.append(new_node)
-
-
-            for child in children:
-                if child in closed_set:
-                    continue
-
-                if child in open_list:
-                    continue
-                
-                dist_with_time = math.dist(cur_node.get_position(), child.get_position())
-                child.set_g(cur_node.get_g() + dist_with_time)
-                child.set_h(math.dist(child.get_position()[:-1], end_tuple[:-1]))
-
-                heapq.heappush(open_list, child)
-
-        print(f"{terminal_colors['FAIL']}{f'No path found: {start} --> {end}'.ljust(55)}{f'|| {start_cell} --> {end_cell}'.ljust(35)}")
+    def record_query(self, owner, path_type, start_id, start_time, end_time, source, cell_path, dist_field, wall_time):
+        """
+        Adds a query to self.stats. h_start and cost are in the units of the
+        search engine's heuristic: CA* cost for "cost" and timesteps for "hops".
+        """
+        h_start = cost = None
+        if dist_field is not None:
+            h_start = max(dist_field[start_id], end_time - start_time)
+        if cell_path is not None:
+            cost = self.graph.path_cost(cell_path) if self.search.metric != "hops" else len(cell_path) - 1
+
+        self.stats.record(robot_id=owner, region=self.region, path_type=path_type,
+                          start_time=start_time, end_time=end_time, source=source,
+                          found=cell_path is not None, h_start=h_start, cost=cost,
+                          path_len=None if cell_path is None else len(cell_path),
+                          wall_time=wall_time, **self.query_counters)
+
+    def add_counters(self):
+        """
+        Adds the counters of the search engine's last search to the current query's.
+        """
+        counters = self.query_counters
+        counters["expanded"] += self.search.expanded
+        counters["generated"] += self.search.generated
+        counters["peak_open"] = max(counters["peak_open"], self.search.peak_open)
+        counters["rejected"] += self.search.rejected
+
+    def run_search(self, start_id, end_id, start_time, end_time, path_type, dist_field, owner,
+                   max_closed, epsilon, deadline, anytime):
+        """
+        Runs the search engine within an expansion budget and deadline. In
+        anytime mode, every path found is followed by another search with
+        half the heuristic inflation, or none once it is below MIN_INFLATION,
+        until the search with epsilon 1.0 or the budget or deadline runs out,
+        and the cheapest path is returned.
+        """
+        model = motion_model(path_type)
+        if not anytime:
+            cell_path = self.search.search(start_id, end_id, start_time, end_time, model, dist_field, owner,
+                                           max_closed, epsilon, deadline)
+            if self.stats is not None:
+                self.add_counters()
+            return cell_path
+
+        best_path, best_cost = None, math.inf
+        while True:
+            cell_path = self.search.search(start_id, end_id, start_time, end_time, model, dist_field, owner,
+                                           max_closed, epsilon, deadline)
+            max_closed -= self.search.expanded
+            if self.stats is not None:
+                self.add_counters()
+            if cell_path is None:
+                break
+            cost = self.graph.path_cost(cell_path)
+            if cost < best_cost:
+                best_path, best_cost = cell_path, cost
+            if epsilon <= 1.0 or max_closed <= 0 or (deadline is not None and time.perf_counter() > deadline):
+                break
+            epsilon = 1.0 + (epsilon - 1.0) / 2
+            if epsilon - 1.0 < self.MIN_INFLATION:
+                epsilon = 1.0
+        return best_path
+
+    def cached_path(self, start_cell, end_cell, start_time, end_time, path_type, owner=None):
+        """
+        Returns the GridGraph ids of the cached static route from start_cell to
+        end_cell, padded with waits at the goal until end_time, or None if
+        there is no route or it conflicts with the reservations.
+        """
+        key = (tuple(start_cell), tuple(end_cell), motion_model(path_type), self.map_fingerprint)
+        route = self.path_cache.get(key, lambda: self.heuristics.route(start_cell, end_cell, path_type))
+        if route is None:
+            return None
+
+        route = route + route[-1:] * (end_time - start_time - len(route) + 1)
+        table_ids = self.graph.table_ids
+        if self.reservations.path_conflict([table_ids[c] for c in route], start_time, owner):
+            self.path_cache.conflicts += 1
+            return None
+        return route
+
+    def record_joint_queries(self, legs, queries, cell_paths, wall_time):
+        """
+        Adds a row to self.stats for every robot of a joint search, with the
+        counters of its own low-level searches and their share of the
+        expansions of the wall time.
+        """
+        counters = self.joint_search.agent_counters
+        total_expanded = sum(c["expanded"] for c in counters.values())
+        for k, (leg, query) in enumerate(zip(legs, queries)):
+            start_id, _, start_time, end_time, _, dist_field, owner, _ = query
+            agent_counters = counters.get(owner, dict.fromkeys(("expanded", "generated", "peak_open", "rejected"), 0))
+            share = agent_counters["expanded"] / total_expanded if total_expanded else 1 / len(queries)
+            cell_path = None if cell_paths is None else cell_paths[k]
+            self.stats.record(robot_id=owner, region=self.region, path_type=leg[4], start_time=start_time,
+                              end_time=end_time, source=self.region_planner, found=cell_path is not None,
+                              h_start=max(dist_field[start_id], end_time - start_time),
+                              cost=None if cell_path is None else self.graph.path_cost(cell_path),
+                              path_len=None if cell_path is None else len(cell_path),
+                              wall_time=wall_time * share, **agent_counters)
+
+    def replan(self, robot_id):
+        """
+        Releases the last path planned for a robot and plans the same query
+        again around the current reservations, e.g. after another robot's path
+        changed. With search_type "incremental" the robot's previous search is
+        repaired rather than repeated.
 
-        return None
+        Returns:
+            list: Points visited at each timestep of the new path
+        """
+        (start, end, start_time, end_time, path_type), cells = self.last_queries[robot_id]
+        self.reservations.release_path(cells, start_time, robot_id)
+        return self.calc_ca_star_path(start, end, start_time, end_time, path_type, robot_id=robot_id)
 
     
-    def plan_next_region(self):
+    def plan_next_region(self, region_id=None):
         """
         1. Plan AMR path to drop location
         2. Execute all drone tasks
@@ -186,7 +326,16 @@ class PathPlanner:
             - Wait till a bit before AMR gets there
             - Plan drone to drop point
         3. Plan AMR to all drop points
+
+        With region_planner "cbs" or "ecbs", steps 1 and 2 are planned in
+        rounds of one leg per robot, each round with Conflict-Based Search.
+
+        Args:
+            region_id (hashable, optional): label of the region's queries in
+                self.stats. Defaults to the number of regions planned before.
         """
+        self.region = self.regions_planned if region_id is None else region_id
+        self.regions_planned += 1
 
         # Get robots involved in region and separate into AMR and Drone
         to_plan = list(self.fleet.get_robots_with_unplanned_tasks())
@@ -198,87 +347,210 @@ class PathPlanner:
             current_amr = current_amr[0]
             use_amr = True
 
-        # Plan AMR path to pick location
+        scripts = []
         if use_amr:
-            amr_to_pick_path = self.calc_ca_star_path(
-                current_amr.get_last_path_pos(),
-                current_amr.get_next_task().pick_point,
-                current_amr.path_time(),
-                current_amr.path_time(),
-                current_amr.robot_id)
-        
-            current_amr.add_path_segment(amr_to_pick_path)
-            current_amr.get_next_task().picked = current_amr.path_time()
-
-        for drone in current_drones:
-            while drone.get_next_task():
-                # Plan Drone path to pick location
-                drone_to_pick_path = self.calc_ca_star_path(
-                    drone.get_last_path_pos(),
-                    drone.get_next_task().pick_point,
-                    drone.path_time(),
-                    drone.path_time(),
-                    drone.robot_id)
-                
-                drone.add_path_segment(drone_to_pick_path)
-                drone.get_next_task().picked = drone.path_time()
-
-                # Plan Drone path to wait at pick location
-                if use_amr:
-                    estimated_dist = diag_dist(drone.get_last_path_pos(),
-                                                    current_amr.get_last_path_pos())
-                    estimated_resume_time = current_amr.path_time() - int(estimated_dist)
-
-                    drone_wait_path = self.calc_ca_star_path(
-                        drone.get_last_path_pos(),
-                        drone.get_last_path_pos(),
-                        drone.path_time(),
-                        estimated_resume_time,
-                        "W")
-                    
-                    drone.add_path_segment(drone_wait_path)
-
-                if use_amr:
-                    drop_time = current_amr.path_time()
-                else:
-                    drop_time = drone.path_time()
-
-                # Plan Drone path to drop/handoff location
-                drone_to_drop_path = self.calc_ca_star_path(
-                    drone.get_last_path_pos(),
-                    drone.get_current_task().drop_point,
-                    drone.path_time(),
-                    drop_time,
-                    drone.robot_id)
-                
-                drone.add_path_segment(drone_to_drop_path)
-                drone.get_current_task().done = drone.path_time()
+            scripts.append(self.amr_pick_legs(current_amr))
+        scripts.extend(self.drone_legs(drone, current_amr if use_amr else None) for drone in current_drones)
+        self.run_legs(scripts, parked=[current_amr.robot_id] if use_amr else ())
 
-        
-        # Plan how long AMR waits for deliveries
         if use_amr:
-            leave_time = max([drone.path_time() for drone in current_drones])
-            amr_wait_path = amr_to_pick_path = self.calc_ca_star_path(
-                current_amr.get_last_path_pos(),
-                current_amr.get_last_path_pos(),
-                current_amr.path_time(),
-                leave_time,
-                "W")
-            
-            current_amr.add_path_segment(amr_wait_path)
-        
+            self.run_legs([self.amr_drop_legs(current_amr, current_drones)])
+
+        # Robots left without tasks stop following reservation changes until they get new ones
+        if self.search_type == "incremental":
+            unplanned = {robot.robot_id for robot in self.fleet.get_robots_with_unplanned_tasks()}
+            for robot in to_plan:
+                if robot.robot_id not in unplanned:
+                    self.search.finish(robot.robot_id)
+
+    def amr_pick_legs(self, amr):
+        """
+        Yields the legs of the region's AMR up to its pick location as
+        (start, end, start_time, end_time, path_type, robot_id), and is sent
+        the path planned for each.
+        """
+        # Plan AMR path to pick location
+        amr.get_next_task().start_time = amr.path_time()
+        path = yield (amr.get_last_path_pos(), amr.get_next_task().pick_point,
+                      amr.path_time(), amr.path_time(), amr.robot_id, None)
+        amr.add_path_segment(path)
+        amr.task_list.mark_picked(amr.get_next_task(), amr.path_time())
+
+    def drone_legs(self, drone, amr=None):
+        """
+        Yields the legs of all of a drone's tasks in the region, like amr_pick_legs.
+        """
+        while drone.get_next_task():
+            # Plan Drone path to pick location
+            drone.get_next_task().start_time = drone.path_time()
+            path = yield (drone.get_last_path_pos(), drone.get_next_task().pick_point,
+                          drone.path_time(), drone.path_time(), drone.robot_id, None)
+            drone.add_path_segment(path)
+            drone.task_list.mark_picked(drone.get_next_task(), drone.path_time())
+
+            # Plan Drone path to wait at pick location
+            if amr is not None:
+                estimated_dist = diag_dist(drone.get_last_path_pos(), amr.get_last_path_pos())
+                estimated_resume_time = amr.path_time() - int(estimated_dist)
+
+                path = yield (drone.get_last_path_pos(), drone.get_last_path_pos(),
+                              drone.path_time(), estimated_resume_time, "W", drone.robot_id)
+                drone.add_path_segment(path)
+
+            if amr is not None:
+                drop_time = amr.path_time()
+            else:
+                drop_time = drone.path_time()
+
+            # Plan Drone path to drop/handoff location
+            path = yield (drone.get_last_path_pos(), drone.get_current_task().drop_point,
+                          drone.path_time(), drop_time, drone.robot_id, None)
+            drone.add_path_segment(path)
+            drone.task_list.mark_done(drone.get_current_task(), drone.path_time())
+
+    def amr_drop_legs(self, amr, drones):
+        """
+        Yields the legs of the region's AMR from its pick location to all drop
+        points, like amr_pick_legs.
+        """
+        # Plan how long AMR waits for deliveries
+        leave_time = max([drone.path_time() for drone in drones])
+        path = yield (amr.get_last_path_pos(), amr.get_last_path_pos(),
+                      amr.path_time(), leave_time, "W", amr.robot_id)
+        amr.add_path_segment(path)
+
         # Plan AMR path to all drop points
-        if use_amr:
-            for drop in current_amr.get_current_task().drop_points:
-                amr_next_drop_path = self.calc_ca_star_path(
-                    current_amr.get_last_path_pos(),
-                    drop,
-                    current_amr.path_time(),
-                    current_amr.path_time(),
-                    current_amr.robot_id)
-                
-                current_amr.add_path_segment(amr_next_drop_path)
-            current_amr.get_current_task().done = current_amr.path_time()
-
-        # for path in current_amr.path:
-        #     print(path)
\ No newline at end of file
+        for drop in amr.get_current_task().drop_points:
+            path = yield (amr.get_last_path_pos(), drop, amr.path_time(), amr.path_time(), amr.robot_id, None)
+            amr.add_path_segment(path)
+        amr.task_list.mark_done(amr.get_current_task(), amr.path_time())
+
+    def run_legs(self, scripts, parked=()):
+        """
+        Plans the legs yielded by each script and sends it the paths. With the
+        sequential region planner each script is run to the end before the
+        next one; otherwise the next leg of every script is planned jointly,
+        round after round.
+
+        Args:
+            scripts (list): generators of legs, like amr_pick_legs
+            parked (iterable, optional): ids of robots whose scripts end where
+                they wait for a leg planned after run_legs returns. Their goals
+                are held through every round's legs once their script is done.
+        """
+        if self.joint_search is None:
+            for script in scripts:
+                leg = next(script, None)
+                while leg is not None:
+                    leg = self.send_path(script, self.plan_leg(leg))
+            return
+
+        legs = {script: next(script, None) for script in scripts}
+        while any(leg is not None for leg in legs.values()):
+            active = [script for script, leg in legs.items() if leg is not None]
+            round_legs = [legs[script] for script in active]
+            round_owners = [path_type if robot_id is None else robot_id for _, _, _, _, path_type, robot_id in round_legs]
+            # Past the time window of every leg of the round by a walk across the map
+            until = max([self.reservations.horizon] + [max(leg[2], leg[3]) for leg in round_legs])
+            until += sum(self.reservations.shape)
+            for owner in parked:
+                if owner in self.last_queries and owner not in round_owners:
+                    self.hold_goal(owner, until)
+            paths = self.plan_legs_jointly(round_legs)
+            for script, path in zip(active, paths):
+                legs[script] = self.send_path(script, path)
+
+    def send_path(self, script, path):
+        """
+        Sends a planned path to a script and returns its next leg, or None
+        once it is done.
+        """
+        try:
+            return script.send(path)
+        except StopIteration:
+            return None
+
+    def plan_leg(self, leg):
+        start, end, start_time, end_time, path_type, robot_id = leg
+        return self.calc_ca_star_path(start, end, start_time, end_time, path_type, robot_id=robot_id)
+
+    def hold_goal(self, owner, until=None):
+        """
+        Reserves the cell a robot's last leg ends at for the
+        ConflictBasedSearch.HOLD timesteps after it, where its next legs
+        start. That leg is planned in a later round, after other robots' legs
+        of this round, and the start of a leg is never checked.
+
+        Args:
+            owner (hashable): robot whose goal to hold
+            until (int, optional): last timestep to hold the goal for instead,
+                for robots whose next leg is only planned after other robots'
+                scripts are done
+        """
+        self.release_hold(owner)
+        (_, _, start_time, _, _), cells = self.last_queries[owner]
+        cell_id = self.reservations.cell_id(cells[-1])
+        arrival = start_time + len(cells) - 1
+        if until is None:
+            until = arrival + self.joint_search.HOLD
+        held = [(cell_id, t) for t in range(arrival + 1, until + 1)
+                if not self.reservations.is_reserved(cell_id, t)]
+        for cell_id, t in held:
+            self.reservations.reserve(cell_id, t, owner)
+        self.holds[owner] = held
+
+    def release_hold(self, owner):
+        for cell_id, t in self.holds.pop(owner, ()):
+            self.reservations.release(cell_id, t, owner)
+
+    def plan_legs_jointly(self, legs):
+        """
+        Plans one leg per robot with the joint (CBS/ECBS) planner and reserves
+        them, along with the cell each robot holds after its leg until its
+        next one. Falls back to planning the legs one after another if the
+        joint planner finds no solution.
+
+        Returns:
+            list: Points visited at each timestep of every leg's path
+        """
+        owners = [path_type if robot_id is None else robot_id for _, _, _, _, path_type, robot_id in legs]
+        for owner in owners:
+            self.release_hold(owner)
+        paths = self.plan_joint_legs(legs)
+        for owner in owners:
+            self.hold_goal(owner)
+        return paths
+
+    def plan_joint_legs(self, legs):
+        queries = []
+        for start, end, start_time, end_time, path_type, robot_id in legs:
+            owner = path_type if robot_id is None else robot_id
+            start_cell, end_cell = self.map.point_to_cell(start), self.map.point_to_cell(end)
+            start_id, end_id = self.graph.encode(start_cell), self.graph.encode(end_cell)
+            dist_field = self.heuristics.get(end_cell, path_type)
+            if dist_field[start_id] == math.inf:
+                return [self.plan_leg(leg) for leg in legs]
+            # The space-time box includes the timesteps the goal is held for
+            max_closed = self.expansion_budget(start_cell, end_cell, start_time,
+                                               max(start_time, end_time) + self.joint_search.HOLD)
+            queries.append((start_id, end_id, start_time, end_time, motion_model(path_type), dist_field, owner,
+                            max_closed))
+
+        if self.stats is not None:
+            query_start = time.perf_counter()
+        cell_paths = self.joint_search.solve(queries)
+        if self.stats is not None:
+            self.record_joint_queries(legs, queries, cell_paths, time.perf_counter() - query_start)
+
+        if cell_paths is None:
+            if len(legs) == 1:
+                return [self.plan_leg(legs[0])]
+            # Plan the legs one at a time, each around the ones before it and their holds
+            return [self.plan_legs_jointly([leg])[0] for leg in legs]
+
+        paths = []
+        for leg, query, cell_path in zip(legs, queries, cell_paths):
+            cells = [self.graph.decode(cell_id) for cell_id in cell_path]
+            self.last_queries[query[6]] = (leg[:5], cells)
+            paths.append(self.commit_path(cells, leg[2], query[6]))
+        return paths
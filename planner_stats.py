@@ -0,0 +1,99 @@
+import json
+import csv
+
+class PlannerStats:
+    """
+    Per-query records of a PathPlanner's searches, with per-robot and
+    per-region aggregates.
+
+    Each record is a flat dict with the robot, region and path type of the
+    query, where its path came from ("cache" or "search"), whether one was
+    found, the search counters (expansions, generated nodes, peak open-list
+    size, reservation-conflict rejections), the heuristic at the start against
+    the final path cost, and the wall time in seconds.
+    """
+    FIELDS = ["robot_id", "region", "path_type", "start_time", "end_time", "source", "found",
+              "expanded", "generated", "peak_open", "rejected", "h_start", "cost", "path_len", "wall_time"]
+
+    def __init__(self):
+        self.records = []
+
+    def __repr__(self):
+        return f"PlannerStats(queries={len(self.records)}, wall_time={self.total('wall_time'):.3f})"
+
+    def __len__(self):
+        return len(self.records)
+
+    def record(self, **fields):
+        self.records.append({field: fields.get(field) for field in self.FIELDS})
+
+    def total(self, field, records=None):
+        records = self.records if records is None else records
+        return sum(r[field] for r in records if r[field] is not None)
+
+    def aggregate(self, records):
+        """
+        Returns the totals of a list of records. heuristic_ratio is the mean
+        of h_start / cost over the searched queries, 1.0 meaning a perfect
+        heuristic.
+        """
+        ratios = [r["h_start"] / r["cost"] for r in records
+                  if r["source"] == "search" and r["h_start"] is not None and r["cost"]]
+        return {
+            "queries" :         len(records),
+            "searches" :        sum(r["source"] == "search" for r in records),
+            "failures" :        sum(not r["found"] for r in records),
+            "expanded" :        self.total("expanded", records),
+            "generated" :       self.total("generated", records),
+            "peak_open" :       max((r["peak_open"] or 0 for r in records), default=0),
+            "rejected" :        self.total("rejected", records),
+            "heuristic_ratio" : sum(ratios) / len(ratios) if ratios else None,
+            "wall_time" :       self.total("wall_time", records),
+        }
+
+    def group_by(self, field):
+        """
+        Returns {value of field: aggregate of the records with that value}.
+        """
+        groups = {}
+        for r in self.records:
+            groups.setdefault(r[field], []).append(r)
+        return {key: self.aggregate(records) for key, records in groups.items()}
+
+    def by_robot(self):
+        return self.group_by("robot_id")
+
+    def by_region(self):
+        return self.group_by("region")
+
+    def summary(self):
+        return {
+            "total" :       self.aggregate(self.records),
+            "by_robot" :    self.by_robot(),
+            "by_region" :   self.by_region(),
+        }
+
+    def to_json(self, file_path=None):
+        """
+        Returns the records and aggregates as a JSON string, also writing it
+        to file_path if given.
+        """
+        summary = self.summary()
+        summary["by_region"] = {str(key): value for key, value in summary["by_region"].items()}
+        text = json.dumps({"records": self.records, "summary": summary}, indent=2)
+        if file_path is not None:
+            with open(file_path, "w") as f:
+                f.write(text)
+        return text
+
+    def to_csv(self, file_path):
+        """
+        Writes one row per query to file_path.
+        """
+        with open(file_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def clear(self):
+        self.records = []
@@ -0,0 +1,186 @@
+from utils import *
+import numpy as np
+import bisect
+
+class ReservationTable:
+    """
+    Space-time reservation table for CA* style planning.
+
+    Every reserved (x, y, z, t) node is packed into a single integer key
+    (t * n_cells + cell_id, where cell_id is the flat index of the cell in the
+    occupancy matrix) and mapped to the id of the robot that owns it. This
+    keeps memory proportional to the number of reserved nodes rather than the
+    size of the warehouse times the planning horizon, and makes vertex and
+    swap (edge) conflict checks a couple of integer dictionary lookups.
+
+    The reserved timesteps of each cell are also kept sorted so that safe
+    intervals can be read off for SIPP, and subscribers are told which keys
+    changed so that incremental searches can repair themselves.
+    """
+
+    def __init__(self, shape):
+        """
+        Args:
+            shape (tuple): (x, y, z) shape of the occupancy matrix to reserve
+                cells in, usually WarehouseMap.occupancy_matrix.shape
+        """
+        self.shape = tuple(shape)
+        self.n_cells = int(np.prod(self.shape))
+        self.owners = {}
+        self.cell_times = {}
+        self.horizon = 0
+        self.subscribers = []
+
+    def __repr__(self):
+        return f"ReservationTable(shape={self.shape}, reserved={len(self.owners)}, horizon={self.horizon})"
+
+    def __len__(self):
+        return len(self.owners)
+
+    def cell_id(self, cell):
+        """
+        Returns the flat index of a Cell (or (x, y, z) tuple) in the occupancy matrix.
+        """
+        x, y, z = cell
+        return (x * self.shape[1] + y) * self.shape[2] + z
+
+    def key(self, cell_id, t):
+        return t * self.n_cells + cell_id
+
+    def is_reserved(self, cell_id, t):
+        """
+        Returns True if any robot occupies the cell at timestep t.
+        """
+        return t * self.n_cells + cell_id in self.owners
+
+    def owner(self, cell_id, t):
+        """
+        Returns the id of the robot occupying the cell at timestep t, or None.
+        """
+        return self.owners.get(t * self.n_cells + cell_id)
+
+    def vertex_conflict(self, cell_id, t, owner=None):
+        """
+        Returns True if the cell is occupied at timestep t by a robot other than owner.
+        """
+        other = self.owners.get(t * self.n_cells + cell_id)
+        return other is not None and other != owner
+
+    def edge_conflict(self, from_id, to_id, t, owner=None):
+        """
+        Returns True if moving from from_id at timestep t to to_id at timestep
+        t+1 swaps places with another robot making the opposite move.
+        """
+        if from_id == to_id:
+            return False
+        other = self.owners.get(t * self.n_cells + to_id)
+        if other is None or other == owner:
+            return False
+        return self.owners.get((t + 1) * self.n_cells + from_id) == other
+
+    def path_conflict(self, cell_ids, start_time, owner=None):
+        """
+        Returns True if a path of flat cell ids starting at start_time breaks
+        any rule CA* plans by: every cell after the first must be unreserved at
+        its timestep and the one after it, and no move may swap with another
+        robot.
+        """
+        n = self.n_cells
+        owners = self.owners
+        for k in range(1, len(cell_ids)):
+            key = (start_time + k) * n + cell_ids[k]
+            if key in owners or key + n in owners:
+                return True
+            if self.edge_conflict(cell_ids[k-1], cell_ids[k], start_time + k - 1, owner):
+                return True
+        return False
+
+    def safe_intervals(self, cell_id):
+        """
+        Returns the (first, last) timesteps of every maximal interval in which
+        a robot may stay in the cell, last being math.inf for the open interval
+        after the final reservation. As in CA*, a robot may only be in a cell at
+        timestep t if it is not reserved at t or t+1.
+        """
+        intervals = []
+        first = 0
+        for t in self.cell_times.get(cell_id, ()):
+            if t - 2 >= first:
+                intervals.append((first, t - 2))
+            first = max(first, t + 1)
+        intervals.append((first, math.inf))
+        return intervals
+
+    def subscribe(self, callback):
+        """
+        Registers callback(keys, owner) to be called with the packed keys of
+        every batch of nodes reserved or released by owner.
+        """
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def notify(self, keys, owner):
+        for callback in self.subscribers:
+            callback(keys, owner)
+
+    def reserve(self, cell_id, t, owner=None):
+        self.owners[t * self.n_cells + cell_id] = owner
+        bisect.insort(self.cell_times.setdefault(cell_id, []), t)
+        self.horizon = max(self.horizon, t + 1)
+        self.notify([t * self.n_cells + cell_id], owner)
+
+    def release(self, cell_id, t, owner=None):
+        """
+        Frees a node reserved with reserve() if it is still held by owner.
+        """
+        key = t * self.n_cells + cell_id
+        if key not in self.owners or self.owners[key] != owner:
+            return
+        del self.owners[key]
+        times = self.cell_times[cell_id]
+        times.pop(bisect.bisect_left(times, t))
+        self.notify([key], owner)
+
+    def reserve_path(self, cells, start_time, owner=None):
+        """
+        Reserves a whole path in one call.
+
+        Args:
+            cells (array-like): (N, 3) cells visited at consecutive timesteps
+            start_time (int): timestep of the first cell
+            owner (hashable, optional): id of the robot taking the path
+        """
+        cells = np.asarray(cells, dtype=np.int64).reshape(-1, 3)
+        if len(cells) == 0:
+            return
+        cell_ids = np.ravel_multi_index(cells.T, self.shape)
+        keys = (cell_ids + np.arange(start_time, start_time + len(cells), dtype=np.int64) * self.n_cells).tolist()
+        self.owners.update(dict.fromkeys(keys, owner))
+        for cell_id, t in zip(cell_ids.tolist(), range(start_time, start_time + len(cells))):
+            bisect.insort(self.cell_times.setdefault(cell_id, []), t)
+        self.horizon = max(self.horizon, start_time + len(cells))
+        self.notify(keys, owner)
+
+    def release_path(self, cells, start_time, owner=None):
+        """
+        Frees the nodes of a path reserved with reserve_path() that are still
+        held by owner.
+        """
+        cells = np.asarray(cells, dtype=np.int64).reshape(-1, 3)
+        released = []
+        for k, cell_id in enumerate(np.ravel_multi_index(cells.T, self.shape).tolist()):
+            key = (start_time + k) * self.n_cells + cell_id
+            if key not in self.owners or self.owners[key] != owner:
+                continue
+            del self.owners[key]
+            times = self.cell_times[cell_id]
+            times.pop(bisect.bisect_left(times, start_time + k))
+            released.append(key)
+        self.notify(released, owner)
+
+    def clear(self):
+        self.owners = {}
+        self.cell_times = {}
+        self.horizon = 0
@@ -1,6 +1,8 @@
 from utils import *
 from warehouse_map import WarehouseMap
+from spatial_index import EndOfPathIndex
 from itertools import chain
+import numpy as np
 
 
 class Robot:
@@ -16,8 +18,14 @@ class Robot:
         self.robot_id = robot_id
         self.pos = pos
         self.task_list = TaskList(tasks=[])
-        self.path = []
-        self.curr_path_idx = [0,0]
+
+        # Positions at every timestep in a growable (T, 3) array, and the index each path segment starts at
+        self.trajectory = np.empty((16, 3))
+        self.n_steps = 0
+        self.segment_starts = []
+        self.curr_step = 0
+        # Callbacks taking the robot, called whenever its path changes
+        self.path_listeners = []
 
     def __repr__(self):
         # return f"Robot('{self.robot_id}', {self.pos})"
@@ -27,47 +35,50 @@ class Robot:
         # So that robots can be sorted by path length - this is untested, comment this out if behavior is weird. Inequality might be flipped.
         return self.path_len() < other.path_len()
 
+    @property
+    def path(self):
+        """
+        Path segments as lists of Points, in the order they were added.
+        """
+        bounds = self.segment_starts + [self.n_steps]
+        return [[Point(*xyz) for xyz in self.trajectory[start:end].tolist()]
+                for start, end in zip(bounds, bounds[1:])]
+
     def path_len(self, r_end=None):
-        if r_end == None:
-            if self.path:
-                return len(list(chain(*self.path)))
-            else:
-                return 0
-        else: return len(list(chain(*self.path[:r_end])))
+        """
+        Returns the number of positions in the path, or in its first r_end segments.
+        """
+        if r_end is None:
+            return self.n_steps
+        n_segments = len(range(len(self.segment_starts))[:r_end])
+        if n_segments < len(self.segment_starts):
+            return self.segment_starts[n_segments]
+        return self.n_steps
 
     def path_time(self):
-        return max(self.path_len() - 1,0)
+        return max(self.n_steps - 1,0)
     
     def get_last_path_pos(self):
-        if self.path_len() > 0:
-            return self.lookup_pos(self.path_len())
+        if self.n_steps > 0:
+            return Point(*self.trajectory[self.n_steps - 1].tolist())
         return self.pos
 
     def lookup_pos(self, time_step_num):
         """
         Get the position of this robot at a given time step (int).
         """
-        unnested_path = list(chain(*self.path))
-        if len(unnested_path) == 0:
+        if self.n_steps == 0:
             return self.pos
-        if time_step_num >= len(unnested_path):
-            return unnested_path[-1]
-        return unnested_path[time_step_num]
+        if time_step_num >= self.n_steps:
+            time_step_num = self.n_steps - 1
+        return Point(*self.trajectory[:self.n_steps][time_step_num].tolist())
 
     def lookup_pos_and_remaining_path_len(self, time_step_num):
         """
         Get the position of the robot and the given time step and the number of steps remaining on it's path. If the path ended before the given timestep, give the number of steps overshot as a negative number.
         """
-        unnested_path = list(chain(*self.path))
-        path_len = len(unnested_path)
-        remaining_path = path_len - time_step_num - 1
-        if path_len == 0:
-            pos = self.pos
-        elif time_step_num >= path_len:
-            pos = unnested_path[-1]
-        else:
-            pos = unnested_path[time_step_num]
-        return (pos, remaining_path)
+        remaining_path = self.n_steps - time_step_num - 1
+        return (self.lookup_pos(time_step_num), remaining_path)
     
     def lookup_last_assigned_pos(self):
         """
@@ -88,17 +99,33 @@ class Robot:
         self.task_list.add_task(task)
 
     def add_path_segment(self, path):
-        self.path.append(path)
+        """
+        Appends a list of Points (or an (N, 3) array) to the path.
+        """
+        if len(path) and not isinstance(path, np.ndarray):
+            path = [(p.x, p.y, p.z) for p in path]
+        segment = np.asarray(path, dtype=float).reshape(-1, 3)
+
+        # Grow by doubling so appends are amortized O(1) per position
+        end = self.n_steps + len(segment)
+        if end > len(self.trajectory):
+            grown = np.empty((max(end, 2 * len(self.trajectory)), 3))
+            grown[:self.n_steps] = self.trajectory[:self.n_steps]
+            self.trajectory = grown
+
+        self.trajectory[self.n_steps:end] = segment
+        self.segment_starts.append(self.n_steps)
+        self.n_steps = end
+        for callback in self.path_listeners:
+            callback(self)
 
     def get_current_task(self): return self.task_list.get_current_task()
 
     def get_next_task(self): return self.task_list.get_next_task()
 
     def update(self):
-        curr_path_idx[1] += 1
-        if curr_path_idx[1] == len(self.path[curr_path_idx[0]]):
-            curr_path_idx = [curr_path_idx[0]+1, 0]
-        self.pos = self.path[curr_path_idx[0],curr_path_idx[1]]
+        self.curr_step += 1
+        self.pos = self.lookup_pos(self.curr_step)
 
 class Drone(Robot):
     robot_type = "Drone"
@@ -117,6 +144,10 @@ class Fleet:
         robots is a dictionary of lists of robots of the key's robot_type
         """
         self.robots = robots
+        # {robot_type: (signature, robots, trajectory tensor, path lengths)}
+        self.trajectory_cache = {}
+        # {robot_type: EndOfPathIndex}, built on the first nearest-robot query
+        self.end_indexes = {}
 
     def __repr__(self):
         return_str = "Fleet({\n"
@@ -135,12 +166,25 @@ class Fleet:
         # print(f"Robot Type: {agent.robot_type}, Robot ID: {agent.robot_id}")
         self.robots[agent.robot_type][agent.robot_id] = agent
         # print(self.robots)
+        for robot_type, index in list(self.end_indexes.items()):
+            if robot_type == agent.robot_type:
+                index.add(agent)
+            elif robot_type == "All":
+                # Keep the tie-breaking order of get_robots_as_list
+                self.drop_end_index("All")
+        if self.end_indexes and self.on_path_changed not in agent.path_listeners:
+            agent.path_listeners.append(self.on_path_changed)
     
     def remove(self, agent):
         # print(f"Removing {agent} from {self.robots}")
         # print(f"Robot Type: {agent.robot_type}, Robot ID: {agent.robot_id}")
         self.robots[agent.robot_type].pop(agent.robot_id)
         # print(self.robots)
+        for index in self.end_indexes.values():
+            if agent in index:
+                index.remove(agent)
+        if self.on_path_changed in agent.path_listeners:
+            agent.path_listeners.remove(self.on_path_changed)
 
     def populate_by_composition(self, fleet_composition, start_points):
         """
@@ -149,6 +193,8 @@ class Fleet:
           [<robot_type2>, <num_of_robot_type2>] ]
         """
         self.robots = {}
+        for robot_type in list(self.end_indexes):
+            self.drop_end_index(robot_type)
         robot_num = 0
         for line in fleet_composition:
             bots = {}
@@ -182,50 +228,110 @@ class Fleet:
             nested_tasks = [robot.task_list.tasks for robot in robots]
             return list(chain(*nested_tasks))
 
+    def task_state_counts(self, robot_type="All"):
+        """
+        Returns the number of pending, active and done tasks over the robots.
+        """
+        counts = dict.fromkeys(TaskList.STATES, 0)
+        for robot in self.get_robots_as_list(robot_type):
+            for state, n in robot.task_list.state_counts().items():
+                counts[state] += n
+        return counts
+
     def longest_path_len(self, robot_type="All"):
         robot_list = self.get_robots_as_list(robot_type)
         path_lens = [bot.path_len() for bot in robot_list]
         return max(path_lens)
 
+    def trajectory_signature(self, robot_list):
+        # Paths are append-only, so a robot's path only changed if its length did
+        return tuple((id(bot), bot.n_steps, None if bot.n_steps else tuple(bot.pos)) for bot in robot_list)
+
+    def trajectory_tensor(self, robot_type="All"):
+        """
+        Returns (robots, tensor, lengths): the robots of robot_type, an
+        (n_robots, T, 3) array of their positions at every timestep up to the
+        longest path, each path held at its last position (or the robot's
+        current one if it has no path), and the path length of each robot.
+
+        The tensor is cached per robot_type and rebuilt when a robot is added,
+        removed or given a new path segment.
+        """
+        robot_list = self.get_robots_as_list(robot_type)
+        signature = self.trajectory_signature(robot_list)
+        cached = self.trajectory_cache.get(robot_type)
+        if cached is not None and cached[0] == signature:
+            return cached[1:]
+
+        lengths = np.array([bot.n_steps for bot in robot_list], dtype=int)
+        tensor = np.empty((len(robot_list), max(lengths.max(initial=0), 1), 3))
+        for i, bot in enumerate(robot_list):
+            n = bot.n_steps
+            tensor[i, :n] = bot.trajectory[:n]
+            tensor[i, n:] = bot.trajectory[n - 1] if n else (bot.pos.x, bot.pos.y, bot.pos.z)
+
+        self.trajectory_cache[robot_type] = (signature, robot_list, tensor, lengths)
+        return robot_list, tensor, lengths
+
+    def positions(self, timesteps, robot_type="All"):
+        """
+        Returns the positions of the robots of robot_type, in the order of
+        get_robots_as_list, as an (n_robots, 3) array for one timestep or a
+        (n_timesteps, n_robots, 3) array for a sequence of them. Robots stay
+        at the end of their paths after they finish.
+        """
+        _, tensor, _ = self.trajectory_tensor(robot_type)
+        steps = np.clip(np.asarray(timesteps, dtype=int), 0, tensor.shape[1] - 1)
+        return np.moveaxis(tensor[:, steps], 0, -2)
+
     def closest_robots(self, point, timestep, robot_type="Drone"):
         """
         Returns a list of the robots closest to a given point at a given time.
         """
+        robot_list, _, _ = self.trajectory_tensor(robot_type)
+        dists = np.abs(self.positions(timestep, robot_type) - (point.x, point.y, point.z)).sum(axis=1)
+        return [robot_list[i] for i in np.flatnonzero(dists == dists.min())]
+
+    def end_index(self, robot_type="All"):
+        """
+        Returns the EndOfPathIndex of the robots of robot_type, building it
+        on first use. It is kept up to date as robots are added, removed or
+        given new path segments.
+        """
         robot_list = self.get_robots_as_list(robot_type)
-        dists = []
-        bots_dists = []
-        for bot in robot_list:
-            bot_pos = bot.lookup_pos(timestep)
-            dist = point.dist_manhattan(bot_pos)
-            dists.append(dist)
-            bots_dists.append([bot, dist])
-        min_dist = min(dists)
-        closest_bots = [bot_dist[0] for bot_dist in bots_dists 
-                        if bot_dist[1]==min_dist]
-        return closest_bots
-
-    def closest_robots_at_end_path(self, point, robot_type="Drone"):
+        index = self.end_indexes.get(robot_type)
+        if index is not None and len(index) != len(robot_list):
+            # The robots dict was changed without add() or remove()
+            self.drop_end_index(robot_type)
+            index = None
+        if index is None:
+            index = EndOfPathIndex()
+            for bot in robot_list:
+                index.add(bot)
+                if self.on_path_changed not in bot.path_listeners:
+                    bot.path_listeners.append(self.on_path_changed)
+            self.end_indexes[robot_type] = index
+        return index
+
+    def drop_end_index(self, robot_type):
+        index = self.end_indexes.pop(robot_type)
+        if not self.end_indexes:
+            for bot in index.entries:
+                if self.on_path_changed in bot.path_listeners:
+                    bot.path_listeners.remove(self.on_path_changed)
+
+    def on_path_changed(self, bot):
+        for index in self.end_indexes.values():
+            index.update(bot)
+
+    def closest_robots_at_end_path(self, point, robot_type="Drone", k=None):
         """
         Returns a list of the robots closest to the given point when at the end
         of their paths. Robots that finish with their currently planned paths
-        sooner are considered to be that much "closer."
-        """
-        robot_list = self.get_robots_as_list(robot_type=robot_type)
-        # dists = []
-        bots_dists = []
-        time = self.longest_path_len(robot_type)
-        for bot in robot_list:
-            (bot_pos, r_steps) = bot.lookup_pos_and_remaining_path_len(time)
-            dist = point.dist_manhattan(bot_pos)+r_steps
-            # dists.append(dist)
-            bots_dists.append([bot, dist])
-
-        # closest_bot = min(bots_dists, key=lambda x: x[1])
-        closest_bots = [bot_dist[0] for bot_dist in sorted(bots_dists, key=lambda x: x[1])]
-        # min_dist = min(dists)
-        # closest_bots = [bot_dist[0] for bot_dist in bots_dists 
-        #                 if bot_dist[1]==min_dist]
-        return closest_bots
+        sooner are considered to be that much "closer." Only the k closest are
+        returned if k is given.
+        """
+        return self.end_index(robot_type).nearest(point, k)
     
     def get_robots_with_unplanned_tasks(self):
         for robot_type, robots in self.robots.items():
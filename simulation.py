@@ -0,0 +1,257 @@
+from utils import *
+from robot_fleet import *
+import numpy as np
+import heapq
+
+class FleetSimulation:
+    """
+    Discrete-time executor stepping a whole fleet along its planned paths.
+
+    Robot state is held as arrays over all robots rather than per Robot: the
+    position, the index of the path segment and of the next unfinished task
+    each robot is on, and whether it is still moving. The paths are packed
+    into one flat (total timesteps, 3) array with a start offset per robot,
+    so a tick is a single gather whatever the number of robots, and memory
+    grows with the total path length rather than robots times the longest
+    path.
+
+    Task cursors count the tasks whose done timestep has passed, from the
+    done fields recorded by the planner; tasks that were never planned stay
+    unfinished.
+    """
+
+    def __init__(self, fleet, delta_t=1, max_sim_time=None, robot_type="All"):
+        """
+        Args:
+            fleet (Fleet): fleet whose planned paths are executed
+            delta_t (int): timesteps advanced per tick
+            max_sim_time (int): timestep to stop at, by default when the
+                longest path ends
+            robot_type (str): only simulate robots of this type
+        """
+        self.fleet = fleet
+        self.delta_t = delta_t
+        self.robots = fleet.get_robots_as_list(robot_type)
+        self.callbacks = []
+        self.t = 0
+        self.ticks = 0
+
+        self.pack_paths()
+        self.pack_tasks()
+        self.horizon = int(self.lengths.max(initial=1)) - 1
+        self.max_sim_time = self.horizon if max_sim_time is None else max_sim_time
+        self.update_state()
+
+    def __repr__(self):
+        return (f"FleetSimulation(robots={len(self.robots)}, t={self.t}, " +
+                f"max_sim_time={self.max_sim_time}, moving={int(self.moving.sum())})")
+
+    def pack_paths(self):
+        """
+        Concatenates the robots' paths, standing in a one-step path at the
+        current position for robots without one.
+        """
+        segments, lengths, starts = [], [], []
+        for bot in self.robots:
+            if bot.n_steps:
+                segments.append(bot.trajectory[:bot.n_steps])
+                starts.append(bot.segment_starts)
+            else:
+                segments.append(np.array([[bot.pos.x, bot.pos.y, bot.pos.z]], dtype=float))
+                starts.append([0])
+            lengths.append(len(segments[-1]))
+
+        self.lengths = np.array(lengths, dtype=int)
+        self.offsets = np.concatenate(([0], np.cumsum(self.lengths)[:-1])).astype(int)
+        self.trajectories = np.concatenate(segments) if segments else np.empty((0, 3))
+
+        # Segment start timesteps, padded with the largest int so they never start
+        n_segments = max(map(len, starts), default=0)
+        self.segment_starts = np.full((len(self.robots), n_segments), np.iinfo(int).max)
+        for i, robot_starts in enumerate(starts):
+            self.segment_starts[i, :len(robot_starts)] = robot_starts
+
+    def pack_tasks(self):
+        """
+        Records the timestep every robot's tasks were picked and finished at,
+        in task list order, as infinity when not planned.
+        """
+        n_tasks = max((len(bot.task_list.tasks) for bot in self.robots), default=0)
+        self.pick_times = np.full((len(self.robots), n_tasks), np.inf)
+        self.done_times = np.full((len(self.robots), n_tasks), np.inf)
+        for i, bot in enumerate(self.robots):
+            for k, task in enumerate(bot.task_list.tasks):
+                if bot.task_list.states[task] != "pending":
+                    self.pick_times[i, k] = task.picked
+                if bot.task_list.states[task] == "done":
+                    self.done_times[i, k] = task.done
+
+    def update_state(self):
+        steps = np.minimum(self.t, self.lengths - 1)
+        self.positions = self.trajectories[self.offsets + steps]
+        self.segment_idx = (self.segment_starts <= self.t).sum(axis=1) - 1
+        self.task_idx = (self.done_times <= self.t).sum(axis=1)
+        self.active_tasks = (self.pick_times <= self.t).sum(axis=1) - self.task_idx
+        self.moving = self.t < self.lengths - 1
+
+    def add_callback(self, callback):
+        """
+        Registers callback(simulation) to be called after every tick.
+        """
+        self.callbacks.append(callback)
+
+    def done(self):
+        return self.t >= self.max_sim_time
+
+    def step(self):
+        self.t = min(self.t + self.delta_t, self.max_sim_time)
+        self.ticks += 1
+        self.update_state()
+        for callback in self.callbacks:
+            callback(self)
+
+    def run(self):
+        """
+        Ticks until max_sim_time and returns the simulation.
+        """
+        while not self.done():
+            self.step()
+        return self
+
+    def sync_robots(self):
+        """
+        Writes the simulated timestep and positions back to the Robot objects.
+        """
+        for bot, xyz in zip(self.robots, self.positions.tolist()):
+            bot.curr_step = self.t
+            bot.pos = Point(*xyz)
+
+class EventSimulation:
+    """
+    Discrete-event simulation of the task lifecycle of a planned fleet.
+
+    Instead of ticking through every timestep, events are kept in a priority
+    queue by timestamp and the clock jumps straight to the next one, so the
+    cost grows with the number of events rather than the simulated time.
+    Events at the same timestep fire in the order of KINDS, then in the order
+    they were scheduled.
+
+    from_plan() turns the timings the planner recorded on every Task into
+    events: "pick" at Task.picked, "handoff" when a drone finishes a task
+    whose region has an AMR, "drop" when any other task finishes, and
+    "region_done" once the last task of a Region is done. Building the
+    events only reads the fleet. The first event processed rewinds the
+    tasks it scheduled to pending and the robots to the start of their
+    paths. Each event then marks its task picked or done in the robot's
+    TaskList and moves the robot to its planned position, so the fleet is
+    as planned again once every event is processed. Other events can be
+    scheduled with schedule() and handled with on().
+    """
+    KINDS = ("pick", "handoff", "drop", "region_done")
+
+    def __init__(self):
+        self.queue = []
+        self.handlers = {}
+        self.t = 0
+        self.n_scheduled = 0
+        self.n_processed = 0
+        # Robots and (robot, task) pairs from_plan() scheduled events for, rewound before the first event
+        self.robots = []
+        self.tasks = []
+
+    def __repr__(self):
+        return f"EventSimulation(t={self.t}, pending={len(self.queue)}, processed={self.n_processed})"
+
+    def __len__(self):
+        return len(self.queue)
+
+    @classmethod
+    def from_plan(cls, fleet):
+        """
+        Schedules the events of every task planned for the fleet, without
+        changing the fleet.
+        """
+        sim = cls()
+        robots = fleet.get_robots_as_list()
+        amr_regions = {task.region for bot in robots if bot.robot_type == "AMR"
+                       for task in bot.task_list.tasks}
+
+        region_ends = {}
+        for bot in robots:
+            sim.robots.append(bot)
+            for task in bot.task_list.tasks:
+                state = bot.task_list.states[task]
+                if state != "pending":
+                    sim.schedule(task.picked, "pick", bot, task)
+                    sim.tasks.append((bot, task))
+                if state == "done":
+                    handoff = bot.robot_type == "Drone" and task.region in amr_regions
+                    sim.schedule(task.done, "handoff" if handoff else "drop", bot, task)
+                    region_ends[task.region] = max(region_ends.get(task.region, task.done), task.done)
+
+        for region, end in region_ends.items():
+            sim.schedule(end, "region_done", region=region)
+        return sim
+
+    def on(self, kind, callback):
+        """
+        Registers callback(simulation, event) to be called for every event of
+        kind, after the simulation has applied it.
+        """
+        self.handlers.setdefault(kind, []).append(callback)
+
+    def schedule(self, time, kind, robot=None, task=None, region=None):
+        """
+        Adds an event at timestep time. Events are dicts with the keys time,
+        kind, robot, task and region.
+        """
+        priority = self.KINDS.index(kind) if kind in self.KINDS else len(self.KINDS)
+        event = {"time": time, "kind": kind, "robot": robot, "task": task, "region": region}
+        heapq.heappush(self.queue, (time, priority, self.n_scheduled, event))
+        self.n_scheduled += 1
+
+    def rewind(self):
+        """
+        Makes the tasks from_plan() scheduled pending again and puts the
+        robots at the start of their paths.
+        """
+        for bot, task in self.tasks:
+            bot.task_list.mark_pending(task)
+        for bot in self.robots:
+            bot.curr_step = 0
+            bot.pos = bot.lookup_pos(0)
+
+    def apply(self, event):
+        robot, task, time = event["robot"], event["task"], event["time"]
+        if robot is None:
+            return
+        robot.curr_step = time
+        robot.pos = robot.lookup_pos(time)
+        if task is not None:
+            if event["kind"] == "pick":
+                robot.task_list.mark_picked(task, time)
+            elif event["kind"] in ("handoff", "drop"):
+                robot.task_list.mark_done(task, time)
+
+    def step(self):
+        """
+        Advances the clock to the next event and processes it.
+        """
+        if not self.n_processed:
+            self.rewind()
+        time, _, _, event = heapq.heappop(self.queue)
+        self.t = time
+        self.apply(event)
+        self.n_processed += 1
+        for callback in self.handlers.get(event["kind"], ()):
+            callback(self, event)
+        return event
+
+    def run(self, until=None):
+        """
+        Processes events in order until the queue is empty or the next event
+        is after timestep until, and returns the simulation.
+        """
+        while self.queue and (until is None or self.queue[0][0] <= until):
+            self.step()
+        return self
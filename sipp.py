@@ -0,0 +1,154 @@
+from utils import *
+import heapq
+import time
+
+class SafeIntervalPlanner:
+    """
+    Safe Interval Path Planning (SIPP) over (cell, safe interval) states.
+
+    Instead of one search node per cell per timestep, every cell gets one node
+    per maximal interval of timesteps in which no reservation forbids being
+    there. Waiting inside an interval is free to represent, so long waits (e.g.
+    drones hovering at a handoff for an AMR) cost about as much to plan as a
+    purely spatial search. Searches minimize arrival time, using the same
+    vertex, lookahead and swap rules as SpaceTimeAStar. Like SpaceTimeAStar,
+    only expanded is kept unless record_stats is set.
+    """
+    metric = "hops"
+
+    def __init__(self, graph, reservations, record_stats=False):
+        self.graph = graph
+        self.reservations = reservations
+        self.record_stats = record_stats
+        self.intervals = {}
+        self.expanded = 0
+        self.generated = 0
+        self.peak_open = 0
+        self.rejected = 0
+
+    def __repr__(self):
+        return f"SafeIntervalPlanner({self.graph})"
+
+    def cell_intervals(self, cell_id):
+        """
+        Returns the safe intervals of a GridGraph cell, cached for one query.
+        """
+        intervals = self.intervals.get(cell_id)
+        if intervals is None:
+            intervals = self.reservations.safe_intervals(self.graph.table_ids[cell_id])
+            self.intervals[cell_id] = intervals
+        return intervals
+
+    def start_interval(self, start_id, start_time):
+        """
+        Returns the (index, last timestep) of the interval a robot starting at
+        start_id can wait in. As in CA*, the start itself is not checked, so a
+        cell reserved exactly at start_time (usually by the robot's own last
+        segment) joins the interval that follows it.
+        """
+        for i, (first, last) in enumerate(self.cell_intervals(start_id)):
+            if first <= start_time <= last or first == start_time + 1:
+                return i, last
+            if first > start_time:
+                break
+        return -1, start_time
+
+    def search(self, start_id, goal_id, start_time, end_time, model, h_field, owner=None, max_closed=math.inf,
+               epsilon=1.0, deadline=None):
+        """
+        Finds the earliest-arriving path from start_id at start_time to goal_id
+        that can stay at the goal until end_time. Takes the same arguments as
+        SpaceTimeAStar.search, with h_field counting timesteps.
+
+        Returns:
+            list: GridGraph ids of the cell at every timestep, or None if no
+                path was found within the budget
+        """
+        self.intervals = {}
+        blocked = self.graph.blocked
+        table_ids = self.graph.table_ids
+        edge_conflict = self.reservations.edge_conflict
+        moves = [offset for offset, _ in self.graph.moves[model] if offset]
+
+        start_idx, start_last = self.start_interval(start_id, start_time)
+        start_key = (start_id, start_idx)
+        arrival = {start_key: start_time}
+        parent = {start_key: None}
+        closed = set()
+
+        open_list = [(start_time + epsilon * max(h_field[start_id], end_time - start_time), start_time, start_id, start_idx, start_last)]
+        n_generated, n_rejected, peak_open = 1, 0, 0
+        goal_key = None
+        count = self.record_stats
+
+        while open_list:
+            if count and len(open_list) > peak_open:
+                peak_open = len(open_list)
+            _, t, cell, idx, last = heapq.heappop(open_list)
+            key = (cell, idx)
+            if key in closed:
+                continue
+            if len(closed) > max_closed:
+                break
+            if deadline is not None and not len(closed) & 1023 and time.perf_counter() > deadline:
+                break
+            closed.add(key)
+
+            # The robot can wait at the goal until end_time
+            if cell == goal_id and last >= end_time:
+                goal_key = key
+                break
+
+            table_id = table_ids[cell]
+            for offset in moves:
+                neighbor = cell + offset
+                if blocked[neighbor]:
+                    continue
+                h = h_field[neighbor]
+                if h == math.inf:
+                    continue
+                neighbor_table_id = table_ids[neighbor]
+
+                for n_idx, (n_first, n_last) in enumerate(self.cell_intervals(neighbor)):
+                    if n_first > last + 1:
+                        break
+
+                    # Earliest arrival that leaves from inside this interval and does not swap with another robot
+                    latest = min(last + 1, n_last)
+                    n_t = max(t + 1, n_first)
+                    while n_t <= latest and edge_conflict(table_id, neighbor_table_id, n_t - 1, owner):
+                        if count:
+                            n_rejected += 1
+                        n_t += 1
+                    if n_t > latest:
+                        continue
+
+                    n_key = (neighbor, n_idx)
+                    if n_key in closed or n_t >= arrival.get(n_key, math.inf):
+                        continue
+                    arrival[n_key] = n_t
+                    parent[n_key] = key
+                    heapq.heappush(open_list, (n_t + epsilon * max(h, end_time - n_t), n_t, neighbor, n_idx, n_last))
+                    if count:
+                        n_generated += 1
+
+        self.expanded = len(closed)
+        self.generated = n_generated if count else 0
+        self.peak_open = peak_open
+        self.rejected = n_rejected
+        return None if goal_key is None else self.backtrack(goal_key, arrival, parent, end_time)
+
+    def backtrack(self, key, arrival, parent, end_time):
+        states = []
+        while key is not None:
+            states.append((key[0], arrival[key]))
+            key = parent[key]
+        states.reverse()
+
+        # Wait in each cell until moving on, then at the goal until end_time
+        path = []
+        for (cell, t), (_, next_t) in zip(states, states[1:]):
+            path.extend([cell] * (next_t - t))
+        goal, goal_t = states[-1]
+        path.extend([goal] * (max(goal_t, end_time) - goal_t + 1))
+        return path
@@ -0,0 +1,130 @@
+from utils import *
+
+class EndOfPathIndex:
+    """
+    Uniform grid hash of where robots will be at the end of their planned
+    paths, for nearest-robot queries during task allocation.
+
+    Robots are bucketed by the (x, y) of their last path position (their
+    current position if they have no path). A robot's distance to a point is
+    the Manhattan distance from that position plus its path length, so robots
+    that finish sooner count as that much closer, as in
+    Fleet.closest_robots_at_end_path. k-nearest queries search the buckets in
+    rings of increasing Chebyshev distance around the point and stop once no
+    robot in the next ring can beat the k-th best found so far.
+
+    Robots are updated one at a time through update(), which Fleet calls
+    whenever a robot's path changes.
+    """
+
+    def __init__(self, cell_size=20.0):
+        self.cell_size = cell_size
+        self.buckets = {}
+        # {robot: (bucket, (x, y, z), path length, insertion order)}
+        self.entries = {}
+        self.n_inserted = 0
+        # Path length counts, for a lower bound on the finish-time penalty
+        self.step_counts = {}
+        self.min_steps = None
+
+    def __repr__(self):
+        return f"EndOfPathIndex(robots={len(self.entries)}, buckets={len(self.buckets)}, cell_size={self.cell_size})"
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, bot):
+        return bot in self.entries
+
+    def bucket(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def add(self, bot):
+        """
+        Inserts bot, or moves it to the end of its current path if already
+        indexed.
+        """
+        order = self.n_inserted
+        if bot in self.entries:
+            order = self.entries[bot][3]
+            self.remove(bot)
+        else:
+            self.n_inserted += 1
+
+        pos = bot.get_last_path_pos()
+        bucket = self.bucket(pos.x, pos.y)
+        self.entries[bot] = (bucket, (pos.x, pos.y, pos.z), bot.path_len(), order)
+        self.buckets.setdefault(bucket, []).append(bot)
+
+        n_steps = bot.path_len()
+        self.step_counts[n_steps] = self.step_counts.get(n_steps, 0) + 1
+        if self.min_steps is None or n_steps < self.min_steps:
+            self.min_steps = n_steps
+
+    def update(self, bot):
+        if bot in self.entries:
+            self.add(bot)
+
+    def remove(self, bot):
+        bucket, _, n_steps, _ = self.entries.pop(bot)
+        self.buckets[bucket].remove(bot)
+        if not self.buckets[bucket]:
+            del self.buckets[bucket]
+
+        self.step_counts[n_steps] -= 1
+        if not self.step_counts[n_steps]:
+            del self.step_counts[n_steps]
+            if n_steps == self.min_steps:
+                self.min_steps = min(self.step_counts, default=None)
+
+    def score(self, point, bot):
+        _, (x, y, z), n_steps, _ = self.entries[bot]
+        return abs(point.x - x) + abs(point.y - y) + abs(point.z - z) + n_steps
+
+    def ring(self, center, r, lo, hi):
+        """
+        Yields the buckets at Chebyshev distance r from center, within the
+        bucket extent [lo, hi].
+        """
+        cx, cy = center
+        if r == 0:
+            yield center
+            return
+        xs = range(max(cx - r, lo[0]), min(cx + r, hi[0]) + 1)
+        for y in (cy - r, cy + r):
+            if lo[1] <= y <= hi[1]:
+                for x in xs:
+                    yield (x, y)
+        for x in (cx - r, cx + r):
+            if lo[0] <= x <= hi[0]:
+                for y in range(max(cy - r + 1, lo[1]), min(cy + r - 1, hi[1]) + 1):
+                    yield (x, y)
+
+    def nearest(self, point, k=None):
+        """
+        Returns the k robots closest to point at the end of their paths,
+        closest first, ties kept in insertion order. k=None returns them all.
+        """
+        if k is None or k >= len(self.entries):
+            return sorted(self.entries, key=lambda bot: (self.score(point, bot), self.entries[bot][3]))
+        if k <= 0:
+            return []
+
+        lo = tuple(min(b[i] for b in self.buckets) for i in range(2))
+        hi = tuple(max(b[i] for b in self.buckets) for i in range(2))
+        center = self.bucket(point.x, point.y)
+        max_r = max(abs(center[0] - lo[0]), abs(center[0] - hi[0]), abs(center[1] - lo[1]), abs(center[1] - hi[1]))
+
+        found = []
+        for r in range(max_r + 1):
+            # Anything in ring r is at least r-1 whole buckets away in x or y
+            if len(found) >= k:
+                kth = sorted(found, key=lambda item: item[:2])[k - 1][0]
+                if (r - 1) * self.cell_size + self.min_steps > kth:
+                    break
+            for bucket in self.ring(center, r, lo, hi):
+                for bot in self.buckets.get(bucket, ()):
+                    found.append((self.score(point, bot), self.entries[bot][3], bot))
+
+        found.sort(key=lambda item: item[:2])
+        return [bot for _, _, bot in found[:k]]
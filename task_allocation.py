@@ -1,8 +1,10 @@
 from utils import *
 from warehouse_map import *
 from robot_fleet import *
-from sklearn.cluster import KMeans
-from k_means_constrained import KMeansConstrained
+from scipy.optimize import linear_sum_assignment
+from cluster_cache import ClusterCache
+from clustering import CLUSTERING_BACKENDS
+import time
 import statistics
 
 # ============================================================================================================
@@ -63,6 +65,7 @@ class Region:
 
             # Give task regional id and drop points list
             task = Task(f"{self.id}", self.pick_point, [task.drop_point for task in sorted_tasks])
+            task.region = self.id
 
 
             # Assign extended task to regional AMR
@@ -73,8 +76,13 @@ class Region:
 # ============================================================================================================
 
 class TaskAllocator:
-    def __init__(self, task_list, fleet, resolution, region_type="homogeneous", handoff_type="no_handoff"):
+    def __init__(self, task_list, fleet, resolution, region_type="homogeneous", handoff_type="no_handoff",
+                 assignment="uncross", metric="manhattan", cluster_cache=None, clustering="exact", points=None):
         self.task_list = task_list
+
+        # Ids of the task points, e.g. the WarehouseMap's registry so ids match its pick_ids and drop_ids
+        self.points = PointRegistry() if points is None else points
+        self.task_list.register_points(self.points)
         
         self.fleet = fleet
 
@@ -82,6 +90,13 @@ class TaskAllocator:
 
         self.regions = []
 
+        # Clusterings can be shared between allocators, e.g. across the fleet compositions of a sweep
+        self.region_type = region_type
+        self.cluster_cache = ClusterCache() if cluster_cache is None else cluster_cache
+        self.clustering = CLUSTERING_BACKENDS[clustering]()
+        # One dict per clustering with the backend, its size, whether it was cached and its phase wall times
+        self.cluster_timings = []
+
         if self.check_for_input_error():
             return
         
@@ -100,10 +115,26 @@ class TaskAllocator:
             "closest2drop_handoff" :        self.closest2drop_handoff
         }
 
+        assignment_options = {
+            "uncross" :                     self.uncross_sweep,
+            "hungarian" :                   self.match_sweep
+        }
+
+        # Distance between each drone's last assigned position and each pick point, from (..., 3) differences
+        metric_options = {
+            "manhattan" :                   lambda d: np.abs(d).sum(axis=-1),
+            "euclidean" :                   lambda d: np.sqrt((d ** 2).sum(axis=-1)),
+            "diag" :                        lambda d: np.sqrt(np.abs(d).sum(axis=-1))
+        }
+
         self.cluster_regions = region_options[region_type]
 
         self.allocate_tasks = handoff_options[handoff_type]
 
+        self.assign_sweep = assignment_options[assignment]
+
+        self.metric = metric_options[metric]
+
         self.dist = 0
 
     def __repr__(self):
@@ -213,24 +244,22 @@ class TaskAllocator:
         
         n_ground_agents = len(self.fleet.get_robots_as_list(robot_type="AMR"))
 
-        KM_tasks = KMeans(
-                    n_clusters=n_ground_agents,
-                    random_state=0,
-                    n_init='auto'
-                ).fit(flattened_pick_points)
+        centers, labels = self.fit_clusters(flattened_pick_points, n_ground_agents)
+
+        # Split the total task list into regional task lists using kmeans labels
+        region_tasks = [[] for _ in range(n_ground_agents)]
+        for task, label in zip(self.task_list.tasks, labels.tolist()):
+            region_tasks[label].append(task)
 
         for i in range(n_ground_agents):
             # Cast the cluster centers as 3D Points with height 5
-            center = Point(int(KM_tasks.cluster_centers_[i][0]), int(KM_tasks.cluster_centers_[i][1]), 5)
-
-            # Split the total task list into regional task lists using kmeans labels
-            region_tasks =  [task for k, task in enumerate(self.task_list.tasks) if (KM_tasks.labels_[k] == i)]
+            center = Point(int(centers[i][0]), int(centers[i][1]), 5)
 
             # Create new region
             r = Region(
                     id=f"R{i}",
                     center=center,
-                    task_list=TaskList(region_tasks),
+                    task_list=TaskList(region_tasks[i]),
                     fleet=Fleet({"AMR":{}, "Drone":{}})
                 )
             
@@ -252,31 +281,53 @@ class TaskAllocator:
 
         n_regions = math.ceil(len(flattened_pick_points) / carrying_capacity)
         
-        KM_tasks = KMeansConstrained(
-                    n_clusters=n_regions,
-                    size_min=2,
-                    size_max = 10,
-                    random_state=0
-                ).fit(flattened_pick_points)
+        centers, labels = self.fit_clusters(flattened_pick_points, n_regions, size_min=2, size_max=10)
+
+        # Split the total task list into regional task lists using kmeans labels
+        region_tasks = [[] for _ in range(n_regions)]
+        for task, label in zip(self.task_list.tasks, labels.tolist()):
+            region_tasks[label].append(task)
 
         for i in range(n_regions):
             # Cast the cluster centers as 3D Points with height 5
-            center = Point(int(KM_tasks.cluster_centers_[i][0]), int(KM_tasks.cluster_centers_[i][1]), 5)
-
-            # Split the total task list into regional task lists using kmeans labels
-            region_tasks =  [task for k, task in enumerate(self.task_list.tasks) if (KM_tasks.labels_[k] == i)]
+            center = Point(int(centers[i][0]), int(centers[i][1]), 5)
 
             # Create new region
             r = Region(
                     id=f"R{i}",
                     center=center,
-                    task_list=TaskList(region_tasks),
+                    task_list=TaskList(region_tasks[i]),
                     fleet=Fleet({"AMR":{}, "Drone":{}})
                 )
             
             # Add to region list
             self.regions.append(r)
 
+    def fit_clusters(self, points, n_clusters, size_min=None, size_max=None):
+        """
+        Clusters points into n_clusters, keeping size_min <= size <= size_max
+        if given, with the clustering backend through the cluster cache.
+        Returns the (n_clusters, n_features) centers and the label of every
+        point, and records the timings in self.cluster_timings.
+        """
+        settings = (self.clustering.name, self.region_type, len(points[0]) if len(points) else 0,
+                    n_clusters, size_min, size_max)
+        misses = self.cluster_cache.misses
+        start = time.perf_counter()
+        centers, labels = self.cluster_cache.get(
+            points, settings, lambda init: self.clustering.fit(points, n_clusters, size_min, size_max, init))
+        cached = self.cluster_cache.misses == misses
+
+        self.cluster_timings.append({
+            "backend" :     self.clustering.name,
+            "n_points" :    len(points),
+            "n_clusters" :  n_clusters,
+            "cached" :      cached,
+            **({} if cached else self.clustering.timings),
+            "wall_time" :   time.perf_counter() - start
+        })
+        return centers, labels
+
 # Region Clustering functions
 # ============================================================================================================
 
@@ -289,7 +340,7 @@ class TaskAllocator:
         Switch any overlapping paths to get an approximated optimal allocation
         """
         # AMR allocated to this region
-        closest_AMR = self.fleet.closest_robots_at_end_path(r.center, robot_type="AMR")[0]
+        closest_AMR = self.fleet.closest_robots_at_end_path(r.center, robot_type="AMR", k=1)[0]
 
         # Assign pick points for each region after AMR has been assigned
         if pick_point == "center":
@@ -308,7 +359,9 @@ class TaskAllocator:
                             0.5 * 1/self.resolution)
         
         elif pick_point == "closest2drop":
-            closest_task_to_drop = min(r.task_list.tasks, key=lambda x: manhattan_dist(x.pick_point, x.drop_point))
+            tasks = r.task_list.tasks
+            pick_drop_dists = self.points.pair_distances([task.pick_id for task in tasks], [task.drop_id for task in tasks])
+            closest_task_to_drop = tasks[int(np.argmin(pick_drop_dists))]
 
             r.pick_point = Point(
                             closest_task_to_drop.pick_point.x,
@@ -324,17 +377,20 @@ class TaskAllocator:
         DPT = Drones per task
         """
         # Drones Per Task of each region if solution is optimal
-        DPT_avg = len(self.fleet.robots["Drone"]) / len(self.task_list.tasks)
+        DPT_avg = self.drones_per_task()
 
-        # value for how many extra drones this region has based on the average estimate
-        n_drone_target = round(DPT_avg * len(r.task_list.tasks))
+        # value for how many extra drones this region has based on the average estimate, at least one so its tasks get done
+        n_drone_target = max(1, round(DPT_avg * len(r.task_list.tasks)))
 
         # closest drones in the fleet to centroid of this region
-        closest_drones = self.fleet.closest_robots_at_end_path(r.center, robot_type="Drone")
+        closest_drones = self.fleet.closest_robots_at_end_path(r.center, robot_type="Drone", k=n_drone_target)
 
         # Move drone to this region's fleet
-        [r.fleet.add(drone) for drone in closest_drones[0:n_drone_target]]
+        [r.fleet.add(drone) for drone in closest_drones]
         
+    def drones_per_task(self):
+        return len(self.fleet.robots["Drone"]) / len(self.task_list.tasks)
+
     def assign_tasks(self, r):
         """
         2. Assign each drone to 1 random task while unclaimed tasks remain
@@ -350,7 +406,7 @@ class TaskAllocator:
         agent_fleet = r.fleet.get_robots_as_list(robot_type="Drone")
         
         # tasks for this region
-        unclaimed_tasks = r.task_list.tasks
+        unclaimed_tasks = r.task_list
 
         # A sorted list of TaskLists corresponding to the sorted droned fleet
         while unclaimed_tasks:
@@ -359,39 +415,23 @@ class TaskAllocator:
             # Semi-arbitrarily assign next sweep of tasks
             for i in range(len(agent_fleet)):
                 if unclaimed_tasks:
-                    task = unclaimed_tasks.pop(0)
+                    task = unclaimed_tasks.pop_task()
                     sweep_task_list.append(task)
 
             # Logging variable keeps track of drone travel distance prior to optimization
             # dist_prior += sum([manhattan_dist(agent_fleet[i].lookup_last_assigned_pos(), task.pick_point) for i,task in enumerate(sweep_task_list)])
 
             # Optimize sweep
-            for i in range(len(sweep_task_list)):
-                k = 0
-                while k < len(sweep_task_list):
-                    path1 = [agent_fleet[i].lookup_last_assigned_pos(), sweep_task_list[i].pick_point]
-                    path2 = [agent_fleet[k].lookup_last_assigned_pos(), sweep_task_list[k].pick_point]
-
-                    # If paths intersect, swap assigned endpoints
-                    if intersect(path1[0], path1[1], path2[0], path2[1]):
-                        t1 = sweep_task_list[i]
-                        t2 = sweep_task_list[k]
-
-                        sweep_task_list[i] = t2
-                        sweep_task_list[k] = t1
-                    
-                        # Restart nested loop for every intersection to check back over previous paths
-                        k = 0
-                    else:
-                        k += 1
+            assignment = self.assign_sweep(agent_fleet, sweep_task_list)
 
             # Logging variable keeps track of drone travel distance post optimization
-            # dist_post += sum([manhattan_dist(agent_fleet[i].lookup_last_assigned_pos(), task.pick_point) for i,task in enumerate(sweep_task_list)])
+            # dist_post += sum([manhattan_dist(agent_fleet[i].lookup_last_assigned_pos(), task.pick_point) for i,task in assignment])
 
             # Assign tasks to drones and AMRs if AMRs exist
-            for i, task in enumerate(sweep_task_list):
+            for i, task in assignment:
                 # Split up task into two parts at handoff point. Will return full task if no AMR in this region
                 drone_task = r.split_task_to_AMR(task)
+                drone_task.region = r.id
 
                 # Add task to drone
                 agent_fleet[i].add_task(drone_task)
@@ -402,6 +442,46 @@ class TaskAllocator:
         # print(f"{r.id} task assignment distance optimized: {dist_prior} -> {dist_post} (ft)")
         # self.dist += dist_post
 
+    def uncross_sweep(self, agent_fleet, sweep_task_list):
+        """
+        Gives the i-th task of the sweep to the i-th drone, then swaps tasks
+        between drones whose paths to their pick points cross until none do.
+        Each drone's path is checked against all others at once, swapping with
+        the first one it crosses. Returns (drone index, task) pairs.
+        """
+        sweep_task_list = list(sweep_task_list)
+        n_tasks = len(sweep_task_list)
+        starts = np.array([tuple(agent.lookup_last_assigned_pos()) for agent in agent_fleet[:n_tasks]], dtype=float)
+        ends = np.array([tuple(task.pick_point) for task in sweep_task_list], dtype=float).reshape(-1, 3)
+
+        for i in range(n_tasks):
+            crossings = intersect_batch(starts[i], ends[i], starts, ends)
+            while crossings.any():
+                # If paths intersect, swap assigned endpoints
+                k = int(np.argmax(crossings))
+                sweep_task_list[i], sweep_task_list[k] = sweep_task_list[k], sweep_task_list[i]
+                ends[[i, k]] = ends[[k, i]]
+
+                # Check back over previous paths after every swap
+                crossings = intersect_batch(starts[i], ends[i], starts, ends)
+
+        return list(enumerate(sweep_task_list))
+
+    def match_sweep(self, agent_fleet, sweep_task_list):
+        """
+        Solves the sweep as a linear assignment problem: the drones and tasks
+        are matched to minimize the total metric distance from each drone's
+        last assigned position to its task's pick point. With fewer tasks
+        than drones, the drones left out are the ones that would travel
+        furthest. Returns (drone index, task) pairs.
+        """
+        agent_pos = np.array([tuple(agent.lookup_last_assigned_pos()) for agent in agent_fleet], dtype=float)
+        pick_pos = np.array([tuple(task.pick_point) for task in sweep_task_list], dtype=float)
+        costs = self.metric(agent_pos[:, None, :] - pick_pos[None, :, :])
+
+        agent_ids, task_ids = linear_sum_assignment(costs)
+        return [(int(i), sweep_task_list[k]) for i, k in zip(agent_ids, task_ids)]
+
 # Task Allocation functions
 # ============================================================================================================
 
@@ -411,4 +491,132 @@ class TaskAllocator:
         return self.dist
 
 # TestLogging functions
-# ============================================================================================================
\ No newline at end of file
+# ============================================================================================================
+
+# ============================================================================================================
+# ONLINE TASK ALLOCATOR
+# ============================================================================================================
+
+class OnlineTaskAllocator(TaskAllocator):
+    """
+    Allocates tasks as they arrive instead of clustering a full TaskList.
+
+    Every new task joins the open region whose center (the running mean of its
+    pick points) is nearest. It starts a new region instead if that center is
+    further than max_radius and fewer than max_open regions are open. A
+    region is sealed once it holds region_size tasks, so adding a task costs
+    O(max_open) whatever the number of tasks so far.
+    Sealed regions go through the usual handoff and assignment steps and are
+    handed on straight away, e.g. to PathPlanner.plan_next_region.
+    """
+
+    def __init__(self, fleet, resolution, handoff_type="closest2drop_handoff", region_size=10, max_radius=60,
+                 max_open=4, on_sealed=None, assignment="uncross", metric="manhattan", points=None):
+        """
+        Args:
+            fleet (Fleet): fleet to allocate tasks to
+            resolution (float): WarehouseMap resolution
+            handoff_type (str): handoff option, as in TaskAllocator
+            region_size (int): number of tasks that seals a region
+            max_radius (float): distance in map units from the nearest open
+                region's center past which a task starts a new region
+            max_open (int): most regions open at once
+            on_sealed (function): called with every region once sealed and
+                allocated
+            points (PointRegistry): registry the task points are added to
+        """
+        super().__init__(TaskList(), fleet, resolution, region_type="homogeneous", handoff_type=handoff_type,
+                         assignment=assignment, metric=metric, points=points)
+        self.handoff_type = handoff_type
+        self.region_size = region_size
+        self.max_radius = max_radius
+        self.max_open = max_open
+        self.on_sealed = on_sealed
+
+        # Open regions and the running sums of their pick point x and y
+        self.open_regions = []
+        self.center_sums = {}
+        self.n_regions = 0
+
+    def __repr__(self):
+        return (f"OnlineTaskAllocator(tasks={len(self.task_list.tasks)}, open={len(self.open_regions)}, " +
+                f"sealed={len(self.regions)})")
+
+    def check_for_input_error(self):
+        # Tasks only arrive later
+        return False
+
+    def drones_per_task(self):
+        # Drones are shared between the tasks still waiting in open regions
+        waiting = sum(len(r.task_list.tasks) for r in self.open_regions)
+        return len(self.fleet.robots["Drone"]) / max(waiting, 1)
+
+    def add_task(self, task):
+        """
+        Places task in a region and returns the regions this sealed.
+        """
+        self.task_list.add_task(task)
+        task.register_points(self.points)
+
+        # xy distance from the task's pick point to each open region's center
+        center_dist = lambda r: abs(r.center.x - task.pick_point.x) + abs(r.center.y - task.pick_point.y)
+
+        region = None
+        if self.open_regions:
+            region = min(self.open_regions, key=center_dist)
+            if center_dist(region) > self.max_radius and len(self.open_regions) < self.max_open:
+                region = None
+
+        sealed = []
+        if region is None:
+            region = Region(
+                    id=f"R{self.n_regions}",
+                    center=None,
+                    task_list=TaskList(),
+                    fleet=Fleet({"Drone":{}} if self.handoff_type == "no_handoff" else {"AMR":{}, "Drone":{}})
+                )
+            self.open_regions.append(region)
+            self.center_sums[region.id] = [0, 0]
+            self.n_regions += 1
+
+        region.task_list.add_task(task)
+        sums = self.center_sums[region.id]
+        sums[0] += task.pick_point.x
+        sums[1] += task.pick_point.y
+        n = len(region.task_list.tasks)
+        region.center = Point(int(sums[0] / n), int(sums[1] / n), 5)
+
+        if n >= self.region_size:
+            sealed.append(self.seal(region))
+        return sealed
+
+    def seal(self, r):
+        """
+        Closes an open region to new tasks, allocates its robots and tasks, and
+        hands it on.
+        """
+        self.allocate_tasks(r)
+        self.open_regions.remove(r)
+        del self.center_sums[r.id]
+        self.regions.append(r)
+        if self.on_sealed is not None:
+            self.on_sealed(r)
+        return r
+
+    def flush(self):
+        """
+        Seals every open region, oldest first, and returns them.
+        """
+        return [self.seal(r) for r in list(self.open_regions)]
+
+    def stream(self, tasks):
+        """
+        Allocates tasks from an iterable, or a queue.Queue ended by putting
+        None, and yields every region as soon as it is sealed. Open regions
+        are flushed when the tasks run out.
+        """
+        if hasattr(tasks, "get"):
+            tasks = iter(tasks.get, None)
+        for task in tasks:
+            yield from self.add_task(task)
+        yield from self.flush()
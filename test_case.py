@@ -1,6 +1,8 @@
 from utils import *
 from warehouse_map import *
 from robot_fleet import *
+from simulation import *
+from validation import *
 
 class TestCase:
     def __init__(self, fleet, task_list, wh_map, task_allocator, path_planner, 
@@ -25,3 +27,20 @@ class TestCase:
                 f"visualizer={self.visualizer},\n" +
                 f"evaluator={self.evaluator},\n" +
                 f"delta_t={self.delta_t}, max_sim_time={self.max_sim_time})")
+
+    def simulate(self, callbacks=()):
+        """
+        Executes the fleet's planned paths in steps of delta_t up to
+        max_sim_time and returns the FleetSimulation.
+        """
+        simulation = FleetSimulation(self.fleet, self.delta_t, self.max_sim_time)
+        for callback in callbacks:
+            simulation.add_callback(callback)
+        return simulation.run()
+
+    def check_conflicts(self, near_misses=False):
+        """
+        Returns the conflicts between the fleet's planned paths found by
+        ConflictChecker.
+        """
+        return ConflictChecker(self.wh_map).find_conflicts(self.fleet, near_misses)
@@ -0,0 +1,88 @@
+import random
+from utils import *
+from warehouse_map import *
+from robot_fleet import *
+from path_planning import *
+from evaluation import *
+from grid_search import SpaceTimeAStar
+
+def make_map():
+    evaluator = Evaluator()
+    wh_map = WarehouseMap(evaluator.generate_wh_info()[0], resolution=0.1, units="ft")
+    pick_points, _ = wh_map.generate_points()
+    return wh_map, pick_points
+
+def test_replan_after_conflicting_reservation():
+    """
+    Another robot reserving a cell on the previously planned path used to
+    leave a path state inconsistent and crash backtrack(). Every repaired
+    path must avoid the reservations and cost as much as a fresh search.
+    """
+    wh_map, pick_points = make_map()
+    for seed in range(20):
+        rng = random.Random(seed)
+        planner = PathPlanner(wh_map, Fleet(), search_type="incremental")
+        start, goal = (Point(p.x, p.y, 15) for p in rng.sample(pick_points, 2))
+        planner.calc_ca_star_path(start, goal, 0, 0, "D", robot_id="D0")
+
+        for k in range(4):
+            _, cells = planner.last_queries["D0"]
+            if len(cells) < 3:
+                break
+            t = rng.randrange(1, len(cells) - 1)
+            planner.reservations.reserve(planner.reservations.cell_id(cells[t]), t, owner=f"X{k}")
+            planner.replan("D0")
+
+        _, cells = planner.last_queries["D0"]
+        planner.reservations.release_path(cells, 0, "D0")
+        table_ids = [planner.reservations.cell_id(c) for c in cells]
+        assert not planner.reservations.path_conflict(table_ids, 0, "D0")
+
+        cell_path = [planner.graph.encode(c) for c in cells]
+        fresh = SpaceTimeAStar(planner.graph, planner.reservations)
+        dist_field = planner.heuristics.get(wh_map.point_to_cell(goal), "D", fresh.metric)
+        reference = fresh.search(cell_path[0], cell_path[-1], 0, 0, motion_model("D"), dist_field, "D0")
+        assert planner.graph.path_cost(cell_path) <= planner.graph.path_cost(reference) + 1e-6
+
+def test_replan_follows_only_nearby_changes():
+    """
+    Searches used to keep every key other robots reserved, so repairing one
+    cost far more than a fresh search. Only changes next to states a search
+    generated are kept, and repairs expand fewer states in total than fresh
+    CA* searches around the same reservations.
+    """
+    wh_map, pick_points = make_map()
+    reserved = pending = replan_expanded = fresh_expanded = 0
+    for seed in range(10):
+        rng = random.Random(seed)
+        planner = PathPlanner(wh_map, Fleet(), search_type="incremental")
+        fresh = SpaceTimeAStar(planner.graph, planner.reservations)
+        queries = []
+        for _ in range(11):
+            start, goal = (wh_map.point_to_cell(Point(p.x, p.y, 15)) for p in rng.sample(pick_points, 2))
+            dist_field = planner.heuristics.get(goal, "D", fresh.metric)
+            queries.append((planner.graph.encode(start), planner.graph.encode(goal), 0, 0, motion_model("D"), dist_field))
+
+        cells = [planner.graph.decode(c) for c in planner.search.search(*queries[0], "D0")]
+        planner.reservations.reserve_path(cells, 0, "D0")
+        for k, query in enumerate(queries[1:]):
+            cell_path = fresh.search(*query, f"X{k}")
+            if cell_path is not None:
+                planner.reservations.reserve_path([planner.graph.decode(c) for c in cell_path], 0, f"X{k}")
+                reserved += len(cell_path)
+        planner.reservations.release_path(cells, 0, "D0")
+
+        search = planner.search.searches["D0"]
+        assert all(any(s in search.rhs for s in search.affected_states(key)) for key in search.changed)
+        pending += len(search.changed)
+        cell_path = planner.search.search(*queries[0], "D0")
+        replan_expanded += planner.search.expanded
+        reference = fresh.search(*queries[0], "D0")
+        fresh_expanded += fresh.expanded
+        assert abs(planner.graph.path_cost(cell_path) - planner.graph.path_cost(reference)) < 1e-6
+
+        planner.search.finish("D0")
+        assert planner.reservations.subscribers == []
+
+    assert pending * 10 < reserved
+    assert replan_expanded * 2 < fresh_expanded
@@ -0,0 +1,59 @@
+import random
+from utils import *
+from warehouse_map import *
+from robot_fleet import *
+from path_planning import *
+from task_allocation import *
+from evaluation import *
+from validation import ConflictChecker
+
+def plan_seeded_regions(seed, region_planner, **options):
+    """
+    Plans 30 random tasks for 6 drones and 2 AMRs region by region and
+    returns the map, the fleet and the PathPlanner.
+    """
+    evaluator = Evaluator()
+    evaluator.set_static("n_drone", 6)
+    evaluator.set_static("n_amr", 2)
+    wh_map = WarehouseMap(evaluator.generate_wh_info()[0], resolution=0.1)
+    pick_points, drop_points = wh_map.generate_points()
+    random.seed(seed)
+    task_list = TaskList()
+    task_list.populate_randomly(pick_points, drop_points, 30)
+    fleet = Fleet({"Drone": {}, "AMR": {}})
+    fleet.populate_by_composition(evaluator.generate_fleet_comp()[0], [Point(p.x, p.y, 5) for p in pick_points])
+    allocator = TaskAllocator(task_list, fleet, wh_map.resolution, region_type="sized_regions",
+                              handoff_type="closest2drop_handoff")
+    allocator.cluster_regions()
+    planner = PathPlanner(wh_map, fleet, region_planner=region_planner, **options)
+    for region in allocator.regions:
+        allocator.allocate_tasks(region)
+        planner.plan_next_region()
+    return wh_map, fleet, planner
+
+def test_joint_plans_are_conflict_free():
+    """
+    Robots parked at the goal of one leg until their next one are obstacles
+    to the other robots of the round: seed 2 used to put D1 and D4 in the
+    same cell at timestep 51, and seed 19 had a drone dodge into the cell
+    its AMR waits in for the region's deliveries.
+    """
+    for seed in (2, 19):
+        for region_planner in ("cbs", "ecbs"):
+            wh_map, fleet, _ = plan_seeded_regions(seed, region_planner)
+            assert ConflictChecker(wh_map).find_conflicts(fleet) == [], (seed, region_planner)
+
+def test_joint_stats_per_robot():
+    """
+    Joint searches record a row for each robot, under its own id, and the
+    rows add up to the search's totals.
+    """
+    _, fleet, planner = plan_seeded_regions(2, "cbs", record_stats=True)
+    robot_ids = {robot.robot_id for robot in fleet.get_robots_as_list()}
+    assert set(planner.stats.by_robot()) == robot_ids
+
+    # The rows of the last joint search
+    search = planner.joint_search
+    rows = [r for r in planner.stats.records if r["source"] == "cbs"][-len(search.agent_counters):]
+    assert {r["robot_id"] for r in rows} == set(search.agent_counters)
+    assert sum(r["expanded"] for r in rows) == search.expanded
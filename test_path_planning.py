@@ -0,0 +1,62 @@
+from utils import *
+from warehouse_map import *
+from robot_fleet import *
+from path_planning import *
+from evaluation import *
+
+def make_map():
+    evaluator = Evaluator()
+    wh_map = WarehouseMap(evaluator.generate_wh_info()[0], resolution=0.1, units="ft")
+    pick_points, _ = wh_map.generate_points()
+    return wh_map, pick_points
+
+def count_searches(planner):
+    """
+    Wraps planner.search.search to record the epsilon of every search run.
+    """
+    epsilons = []
+    search = planner.search.search
+    def counted(*args):
+        epsilons.append(args[8])
+        return search(*args)
+    planner.search.search = counted
+    return epsilons
+
+def test_anytime_search_ends_at_epsilon_one():
+    """
+    Halving the inflation used to approach epsilon 1.0 without reaching it,
+    running dozens of searches for one query.
+    """
+    wh_map, pick_points = make_map()
+    planner = PathPlanner(wh_map, Fleet())
+    start_cell, end_cell = (wh_map.point_to_cell(Point(p.x, p.y, 15)) for p in (pick_points[0], pick_points[-1]))
+    start_id, end_id = planner.graph.encode(start_cell), planner.graph.encode(end_cell)
+    dist_field = planner.heuristics.get(end_cell, "D", planner.search.metric)
+    max_closed = planner.expansion_budget(start_cell, end_cell, 0, 0)
+
+    epsilons = count_searches(planner)
+    cell_path = planner.run_search(start_id, end_id, 0, 0, "D", dist_field, "D0", max_closed, 3.0, None, True)
+    assert cell_path is not None
+    assert epsilons == [3.0, 2.0, 1.5, 1.25, 1.125, 1.0625, 1.0]
+
+    # Out of expansions after the first path, so no search follows it
+    planner.search.search(start_id, end_id, 0, 0, motion_model("D"), dist_field, "D0", max_closed, 3.0, None)
+    max_closed = planner.search.expanded
+    epsilons = count_searches(planner)
+    cell_path = planner.run_search(start_id, end_id, 0, 0, "D", dist_field, "D0", max_closed, 3.0, None, True)
+    assert cell_path is not None and epsilons == [3.0]
+
+def test_path_cache_is_opt_in():
+    """
+    Routes are only taken from a PathCache passed to a "ca_star" planner, so
+    the other engines run their own searches.
+    """
+    wh_map, pick_points = make_map()
+    start, goal = (Point(p.x, p.y, 15) for p in (pick_points[0], pick_points[-1]))
+    for search_type, path_cache, source in [("ca_star", None, "search"), ("ca_star", PathCache(), "cache"),
+                                            ("sipp", PathCache(), "search"), ("incremental", PathCache(), "search")]:
+        planner = PathPlanner(wh_map, Fleet(), search_type=search_type, path_cache=path_cache, record_stats=True)
+        planner.calc_ca_star_path(start, goal, 0, 0, "D", robot_id="D0")
+        assert planner.stats.records[-1]["source"] == source, search_type
+        if path_cache is not None:
+            assert len(path_cache) == (source == "cache")
@@ -0,0 +1,66 @@
+import random
+from utils import *
+from warehouse_map import *
+from robot_fleet import *
+from path_planning import *
+from task_allocation import *
+from evaluation import *
+from simulation import EventSimulation
+
+def plan_fleet(seed):
+    """
+    Plans 30 random tasks for 6 drones and 2 AMRs and returns the fleet.
+    """
+    evaluator = Evaluator()
+    evaluator.set_static("n_drone", 6)
+    evaluator.set_static("n_amr", 2)
+    wh_map = WarehouseMap(evaluator.generate_wh_info()[0], resolution=0.1)
+    pick_points, drop_points = wh_map.generate_points()
+    random.seed(seed)
+    task_list = TaskList()
+    task_list.populate_randomly(pick_points, drop_points, 30)
+    fleet = Fleet({"Drone": {}, "AMR": {}})
+    fleet.populate_by_composition(evaluator.generate_fleet_comp()[0], [Point(p.x, p.y, 5) for p in pick_points])
+    allocator = TaskAllocator(task_list, fleet, wh_map.resolution, region_type="sized_regions",
+                              handoff_type="closest2drop_handoff")
+    allocator.cluster_regions()
+    planner = PathPlanner(wh_map, fleet)
+    for region in allocator.regions:
+        allocator.allocate_tasks(region)
+        planner.plan_next_region()
+    return fleet
+
+def task_timings(fleet):
+    return {(bot.robot_id, task.task_id): (bot.task_list.states[task], task.picked, task.done, task.end_time)
+            for bot in fleet.get_robots_as_list() for task in bot.task_list.tasks}
+
+def test_replay_marks_tasks_and_moves_robots():
+    """
+    Building the events leaves the planned fleet alone, a partial replay
+    leaves every task in its state at that timestep, and a full replay
+    leaves the fleet's tasks as planned.
+    """
+    fleet = plan_fleet(2)
+    planned = task_timings(fleet)
+    planned_counts = fleet.task_state_counts()
+
+    sim = EventSimulation.from_plan(fleet)
+    assert task_timings(fleet) == planned
+
+    until = max(done for _, _, done, _ in planned.values()) // 2
+    sim.run(until)
+    for bot in fleet.get_robots_as_list():
+        for task in bot.task_list.tasks:
+            state, picked, done, _ = planned[bot.robot_id, task.task_id]
+            if state == "done" and done <= until:
+                assert bot.task_list.states[task] == "done"
+            elif state != "pending" and picked <= until:
+                assert bot.task_list.states[task] == "active"
+            else:
+                assert bot.task_list.states[task] == "pending"
+
+    sim.run()
+    assert task_timings(fleet) == planned
+    assert fleet.task_state_counts() == planned_counts
+    for bot in fleet.get_robots_as_list():
+        assert bot.pos == bot.lookup_pos(bot.curr_step)
@@ -0,0 +1,51 @@
+from utils import *
+from warehouse_map import *
+from robot_fleet import *
+from evaluation import *
+from validation import ConflictChecker
+
+def make_map():
+    evaluator = Evaluator()
+    return WarehouseMap(evaluator.generate_wh_info()[0], resolution=0.1, units="ft")
+
+def test_conflict_times_across_segments():
+    """
+    Legs start at the last trajectory index, so D0's second segment repeats
+    timestep 1 and its third starts a timestep after the second ended, at
+    3: D0 meets D1 at (35, 5) at timestep 4, the sixth position of its
+    trajectory.
+    """
+    wh_map = make_map()
+    d0, d1 = Drone("D0", Point(5, 5, 5)), Drone("D1", Point(35, 25, 5))
+    d0.add_path_segment([Point(5, 5, 5), Point(15, 5, 5)])
+    d0.add_path_segment([Point(15, 5, 5), Point(25, 5, 5)])
+    d0.add_path_segment([Point(25, 5, 5), Point(35, 5, 5)])
+    d1.add_path_segment([Point(35, 25, 5), Point(35, 15, 5), Point(45, 15, 5), Point(45, 5, 5), Point(35, 5, 5)])
+    fleet = Fleet({"Drone": {}})
+    fleet.add(d0)
+    fleet.add(d1)
+
+    checker = ConflictChecker(wh_map)
+    conflicts = checker.find_conflicts(fleet)
+    assert [(c["kind"], c["time"], c["cell"]) for c in conflicts] == [("vertex", 4, wh_map.point_to_cell(Point(35, 5, 5)))]
+
+    # A robot never conflicts with the repeated start of its own segment
+    assert checker.find_conflicts(fleet, near_misses=True) == conflicts
+
+def test_swap_keys_beyond_int64():
+    """
+    Swaps are still found when packed move keys would overflow int64.
+    """
+    wh_map = make_map()
+    d0, d1 = Drone("D0", Point(5, 5, 5)), Drone("D1", Point(15, 5, 5))
+    d0.add_path_segment([Point(5, 5, 5), Point(15, 5, 5)])
+    d1.add_path_segment([Point(15, 5, 5), Point(5, 5, 5)])
+    fleet = Fleet({"Drone": {}})
+    fleet.add(d0)
+    fleet.add(d1)
+
+    checker = ConflictChecker(wh_map)
+    expected = checker.find_conflicts(fleet)
+    assert [c["kind"] for c in expected] == ["swap"]
+    checker.n_cells = 2 ** 32
+    assert [(c["kind"], c["time"]) for c in checker.find_conflicts(fleet)] == [("swap", 0)]
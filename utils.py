@@ -2,19 +2,39 @@ import random
 import math
 import numpy as np
 import copy
+from collections import deque
+from operator import itemgetter
 
-class Location:
-    def __init__(self, x, y, z):
-        self.x = x
-        self.y = y
-        self.z = z
+class Location(tuple):
+    """
+    Immutable (x, y, z) stored as a tuple. Locations compare and hash by
+    value, but only equal locations of the same class are equal, so a Point
+    and a Cell with the same coordinates are different keys.
+    """
+    __slots__ = ()
+
+    def __new__(cls, x, y, z):
+        return tuple.__new__(cls, (x, y, z))
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    x = property(itemgetter(0))
+    y = property(itemgetter(1))
+    z = property(itemgetter(2))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    # Equal coordinates of different classes only collide, they are never equal
+    __hash__ = tuple.__hash__
 
     def __repr__(self):
         return f"Location({self.x},{self.y},{self.z})"
     
-    def __iter__(self):
-        return iter((self.x, self.y, self.z))
-    
     def as_str(self):
         return f"({self.x},{self.y},{self.z})"
     
@@ -31,10 +51,14 @@ class Location:
         return math.sqrt(dx + dy + dz)
 
 class Point(Location):
+    __slots__ = ()
+
     def __repr__(self):
         return f"Point({self.x},{self.y},{self.z})"
 
 class Cell(Location):
+    __slots__ = ()
+
     def __repr__(self):
         return f"Cell({self.x},{self.y},{self.z})"
 
@@ -97,6 +121,9 @@ class CellZone(Zone):
         return f"CellZone({self.x_lims}, {self.y_lims}, {self.z_lims})"
 
 class Task: 
+    __slots__ = ("task_id", "pick_point", "drop_points", "assigned_robot", "picked", "done",
+                 "start_time", "end_time", "region", "pick_id", "drop_ids")
+
     def __init__(self, task_id, pick_point, drop_points, 
                  robot=None, picked=0, done=0):
         self.task_id = task_id
@@ -105,8 +132,14 @@ class Task:
         self.assigned_robot = robot
         self.picked = picked
         self.done = done
+        # Timesteps the assigned robot sets off for the pick point and finishes
         self.start_time = None
         self.end_time = None
+        # Id of the Region the task was allocated in
+        self.region = None
+        # PointRegistry ids of the pick and drop points, set by register_points
+        self.pick_id = None
+        self.drop_ids = None
     
     def __repr__(self):
         if self.assigned_robot == None:
@@ -120,6 +153,18 @@ class Task:
     @property
     def drop_point(self):
         return self.drop_points[0]
+
+    @property
+    def drop_id(self):
+        return self.drop_ids[0]
+
+    def register_points(self, registry):
+        """
+        Sets pick_id and drop_ids from a PointRegistry, adding any points it
+        does not have yet.
+        """
+        self.pick_id = registry.register(self.pick_point)
+        self.drop_ids = registry.register_all(self.drop_points)
     
     def location(self, time=None):
         if time == None or time == 0 or self.assigned_robot == None:
@@ -136,10 +181,18 @@ class Task:
         
 
 class TaskList:
+    """
+    Tasks in the order they were added, also kept in pending, active (picked
+    but not done) and done queues so the current and next task are found in
+    O(1). Tasks should change state through mark_picked() and mark_done().
+    """
+    STATES = ("pending", "active", "done")
+
     def __init__(self, tasks=None):
         if tasks == None:
             self.tasks = []
         else: self.tasks = tasks
+        self.index_tasks()
         
     
     def __repr__(self):
@@ -156,30 +209,107 @@ class TaskList:
             tasklist_rep += ",\n" + indent + self.tasks[i].__repr__()
         tasklist_rep += " ])"
         return tasklist_rep
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def index_tasks(self):
+        """
+        Rebuilds the state queues from the picked and done fields of the tasks.
+        """
+        self.queues = {state: deque() for state in self.STATES}
+        self.states = {}
+        for task in self.tasks:
+            self.enqueue(task, self.task_state(task))
+
+    def task_state(self, task):
+        if not task.picked:
+            return "pending"
+        if not task.done:
+            return "active"
+        return "done"
+
+    def enqueue(self, task, state):
+        self.states[task] = state
+        self.queues[state].append(task)
+
+    def dequeue(self, task):
+        queue = self.queues[self.states.pop(task)]
+        # Tasks are almost always picked and finished in order
+        if queue and queue[0] is task:
+            queue.popleft()
+        else:
+            queue.remove(task)
         
     def add_task(self, task):
         self.tasks.append(task)
+        self.enqueue(task, self.task_state(task))
 
     def remove_task(self, task):
         i = self.tasks.index(task)
         self.tasks.pop(i)
+        self.dequeue(task)
+
+    def pop_task(self, i=0):
+        """
+        Removes and returns the i-th task.
+        """
+        task = self.tasks.pop(i)
+        self.dequeue(task)
+        return task
+
+    def mark_picked(self, task, time):
+        """
+        Records that task was picked at timestep time and makes it active.
+        """
+        task.picked = time
+        self.dequeue(task)
+        self.enqueue(task, "active")
+
+    def mark_done(self, task, time):
+        """
+        Records that task was finished at timestep time.
+        """
+        task.done = time
+        task.end_time = time
+        self.dequeue(task)
+        self.enqueue(task, "done")
+
+    def mark_pending(self, task):
+        """
+        Forgets when task was picked and finished and makes it pending again.
+        """
+        task.picked = task.done = 0
+        task.end_time = None
+        self.dequeue(task)
+        self.enqueue(task, "pending")
 
     def get_current_task(self):
-        for task in self.tasks:
-            if task.picked and not task.done:
-                return task
-        return None
+        active = self.queues["active"]
+        return active[0] if active else None
             
     def get_next_task(self):
-        for task in self.tasks:
-            if not task.picked:
-                return task
-        return None
+        pending = self.queues["pending"]
+        return pending[0] if pending else None
     
     def get_last_task(self):
         if len(self.tasks) > 0:
             return self.tasks[-1]
         return None
+
+    def register_points(self, registry):
+        """
+        Sets the pick_id and drop_ids of every task from a PointRegistry,
+        adding any points it does not have yet.
+        """
+        for task in self.tasks:
+            task.register_points(registry)
+
+    def state_counts(self):
+        """
+        Returns the number of pending, active and done tasks.
+        """
+        return {state: len(queue) for state, queue in self.queues.items()}
     
     def populate_randomly(self, pick_points, drop_points, num_tasks, task_id_prefix="T"):
         self.tasks = []
@@ -188,6 +318,7 @@ class TaskList:
             pick_point = random.choice(pick_points)
             drop_point = random.choice(drop_points)
             self.tasks.append(Task(task_id, pick_point, drop_point))
+        self.index_tasks()
 
 def manhattan_dist(point1, point2):
     dx = abs(point1.x - point2.x)
@@ -216,6 +347,21 @@ def intersect(A,B,C,D):
         return ccw(A,C,D) != ccw(B,C,D) and ccw(A,B,C) != ccw(A,B,D)
     return False
 
+def ccw_batch(A, B, C):
+    """
+    ccw over broadcastable arrays of (x, y, z) points.
+    """
+    return (C[...,1]-A[...,1]) * (B[...,0]-A[...,0]) > (B[...,1]-A[...,1]) * (C[...,0]-A[...,0])
+
+def intersect_batch(A, B, C, D):
+    """
+    intersect over broadcastable arrays of (x, y, z) segment endpoints: the
+    result holds whether segment AB crosses segment CD for every pair of
+    segments the arrays broadcast to.
+    """
+    equal = np.all(A == C, axis=-1) & np.all(B == D, axis=-1)
+    return ~equal & (ccw_batch(A,C,D) != ccw_batch(B,C,D)) & (ccw_batch(A,B,C) != ccw_batch(A,B,D))
+
 terminal_colors = {
     "HEADER" : '\033[95m',
     "OKBLUE" : '\033[94m',
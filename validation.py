@@ -0,0 +1,166 @@
+from utils import *
+from robot_fleet import *
+import numpy as np
+
+class ConflictChecker:
+    """
+    Checks a fleet's planned trajectories for collisions, independently of
+    the reservation table that produced them.
+
+    Every robot's position at every timestep is converted to its cell in the
+    WarehouseMap occupancy matrix and packed into one integer key
+    t * n_cells + cell. Sorting the keys of all robots together puts robots in
+    the same cell at the same time next to each other, so all conflicts are
+    found with a few array passes instead of comparing every pair of robots
+    at every timestep:
+
+    - "vertex": two robots in the same cell at timestep t
+    - "swap": two robots exchange cells between timesteps t and t+1
+    - "follow" (near misses, optional): a robot enters at t+1 the cell another
+      one occupied at t, which CA* forbids through its lookahead rule
+
+    Conflicts are dicts with the kind, the timestep, the two robot ids and
+    the cell. Robots are only checked while on their paths unless
+    include_parked is set, as they hold no reservation once parked.
+
+    Timesteps are the planner's, not trajectory indices. The planner starts
+    every leg at Robot.path_time(), the last index of the trajectory so far,
+    so a robot's second segment starts with the position and timestep its
+    first one ended at. That repeated position is dropped and every index
+    from it on is one timestep ahead, found from Robot.segment_starts.
+    """
+    KINDS = ("vertex", "swap", "follow")
+
+    def __init__(self, wh_map):
+        self.map = wh_map
+        self.shape = wh_map.occupancy_matrix.shape
+        self.n_cells = int(np.prod(self.shape))
+
+    def __repr__(self):
+        return f"ConflictChecker(shape={self.shape})"
+
+    def cell_ids(self, positions):
+        """
+        Returns the flat occupancy matrix index of the cell of every position
+        in an (..., 3) array, like WarehouseMap.point_to_cell.
+        """
+        lims = np.array([self.map.wh_zone.x_lims[0], self.map.wh_zone.y_lims[0], self.map.wh_zone.z_lims[0]])
+        cells = ((positions - lims) * self.map.resolution).astype(np.int64)
+        cells = np.clip(cells, 0, np.array(self.shape) - 1)
+        return np.ravel_multi_index(np.moveaxis(cells, -1, 0), self.shape)
+
+    def timesteps(self, robots, horizon):
+        """
+        Returns the planner timestep of the first horizon trajectory indices
+        of every robot, as an (n_robots, horizon) array, and a mask of the
+        indices that repeat the timestep before them.
+        """
+        second_starts = np.array([bot.segment_starts[1] if len(bot.segment_starts) > 1 else horizon
+                                  for bot in robots], dtype=np.int64)
+        indices = np.arange(horizon)
+        times = indices - (indices >= second_starts[:, None])
+        repeats = indices == second_starts[:, None]
+        return times, repeats
+
+    def duplicate_groups(self, keys):
+        """
+        Returns the indices into keys of every group of equal keys with more
+        than one member. keys is a 1-D array, or a 2-D array of key rows.
+        """
+        if keys.ndim > 1:
+            keys = np.unique(keys, axis=0, return_inverse=True)[1].ravel()
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.r_[starts, len(keys)])
+        return [order[start:start + size] for start, size in zip(starts[sizes > 1], sizes[sizes > 1])]
+
+    def find_conflicts(self, fleet, near_misses=False, include_parked=False):
+        """
+        Returns every conflict between the paths of the fleet's robots.
+
+        Args:
+            fleet (Fleet): fleet with planned paths
+            near_misses (bool): also report "follow" conflicts
+            include_parked (bool): also check robots at the ends of their
+                paths until the longest path ends
+
+        Returns:
+            list: dicts with kind, time, robot_a, robot_b and cell (a Cell)
+        """
+        robots, tensor, lengths = fleet.trajectory_tensor("All")
+        n_robots, horizon = tensor.shape[:2]
+        cells = self.cell_ids(tensor)
+        times, repeats = self.timesteps(robots, horizon)
+        robot_idx = np.broadcast_to(np.arange(n_robots)[:, None], (n_robots, horizon))
+        if include_parked:
+            on_path = np.broadcast_to((lengths > 0)[:, None], (n_robots, horizon))
+        else:
+            on_path = np.arange(horizon) < lengths[:, None]
+        valid = on_path & ~repeats
+
+        conflicts = []
+        keys = times[valid] * self.n_cells + cells[valid]
+        owners = robot_idx[valid]
+        for group in self.duplicate_groups(keys):
+            self.add_pairs(conflicts, "vertex", keys[group[0]], owners[group], robots)
+
+        # Moves between t and t+1, keyed by the unordered pair of cells. A repeated position has the cell and
+        # timestep of the one before it, so only the step into it is left out
+        moving = on_path[:, :-1] & valid[:, 1:] & (cells[:, :-1] != cells[:, 1:])
+        src, dst = cells[:, :-1][moving], cells[:, 1:][moving]
+        move_times = times[:, :-1][moving]
+        lo, hi = np.minimum(src, dst), np.maximum(src, dst)
+        if (int(times.max(initial=0)) + 1) * self.n_cells ** 2 < 2 ** 63:
+            move_keys = (move_times * self.n_cells + lo) * self.n_cells + hi
+        else:
+            # Packed keys would overflow int64 on very large maps
+            move_keys = np.stack([move_times, lo, hi], axis=1)
+        movers = robot_idx[:, :-1][moving]
+        for group in self.duplicate_groups(move_keys):
+            # Same-direction moves into one cell are already vertex conflicts
+            forward = src[group] < dst[group]
+            t, cell = int(move_times[group[0]]), int(min(src[group[0]], dst[group[0]]))
+            for a in movers[group][forward]:
+                for b in movers[group][~forward]:
+                    conflicts.append(self.conflict("swap", t, robots[a], robots[b], cell))
+
+        if near_misses:
+            # A robot's keys one timestep later collide with the next robot's keys
+            shifted = keys + self.n_cells
+            all_keys = np.concatenate([shifted, keys])
+            source = np.r_[np.zeros(len(keys), dtype=bool), np.ones(len(keys), dtype=bool)]
+            all_owners = np.concatenate([owners, owners])
+            for group in self.duplicate_groups(all_keys):
+                leavers = all_owners[group][~source[group]]
+                enterers = all_owners[group][source[group]]
+                for a in leavers:
+                    for b in enterers:
+                        if a != b:
+                            t, cell = divmod(int(all_keys[group[0]]) - self.n_cells, self.n_cells)
+                            conflicts.append(self.conflict("follow", t, robots[a], robots[b], cell))
+
+        conflicts.sort(key=lambda c: (c["time"], self.KINDS.index(c["kind"]), c["robot_a"], c["robot_b"]))
+        return conflicts
+
+    def add_pairs(self, conflicts, kind, key, owners, robots):
+        t, cell = divmod(int(key), self.n_cells)
+        owners = list(owners)
+        for i, a in enumerate(owners):
+            for b in owners[i + 1:]:
+                conflicts.append(self.conflict(kind, t, robots[a], robots[b], cell))
+
+    def conflict(self, kind, t, robot_a, robot_b, cell):
+        xy, z = divmod(cell, self.shape[2])
+        x, y = divmod(xy, self.shape[1])
+        return {"kind": kind, "time": t, "robot_a": robot_a.robot_id, "robot_b": robot_b.robot_id,
+                "cell": Cell(x, y, z)}
+
+    def summary(self, conflicts):
+        """
+        Returns the number of conflicts of each kind.
+        """
+        counts = dict.fromkeys(self.KINDS, 0)
+        for c in conflicts:
+            counts[c["kind"]] += 1
+        return counts
@@ -313,9 +313,9 @@ class Visualizer:
         robot_list = self.fleet.get_robots_as_list()
         bot_num = 0
         for bot in robot_list:
-            for i in range(len(bot.path)):
+            for i, segment in enumerate(bot.path):
                 t_start = bot.path_len(r_end=i)
-                path_traces.append(self.make_path_trace(bot.path[i],f"{bot.robot_id}-{i}", 
+                path_traces.append(self.make_path_trace(segment,f"{bot.robot_id}-{i}", 
                                 self.color(bot_num), t_start, show_t=self.show_t))
             bot_num += 1
         return path_traces
@@ -326,19 +326,21 @@ class Visualizer:
         drone_marker = dict(size=7, color="blue")
         amr_list = self.fleet.get_robots_as_list(robot_type="AMR")
         drone_list = self.fleet.get_robots_as_list(robot_type="Drone")
+        amr_pos = self.fleet.positions(frame_num, robot_type="AMR")
+        drone_pos = self.fleet.positions(frame_num, robot_type="Drone")
         scatters.append(go.Scatter3d(
-                x=[bot.lookup_pos(frame_num).x for bot in amr_list],
-                y=[bot.lookup_pos(frame_num).y for bot in amr_list],
-                z=[bot.lookup_pos(frame_num).z for bot in amr_list],
+                x=amr_pos[:, 0],
+                y=amr_pos[:, 1],
+                z=amr_pos[:, 2],
                 mode='markers+text',
                 marker=amr_marker,
                 name=f"AMRs at t={frame_num}",
                 showlegend=True,
                 text=[bot.robot_id for bot in amr_list]))
         scatters.append(go.Scatter3d(
-                x=[bot.lookup_pos(frame_num).x for bot in drone_list],
-                y=[bot.lookup_pos(frame_num).y for bot in drone_list],
-                z=[bot.lookup_pos(frame_num).z for bot in drone_list],
+                x=drone_pos[:, 0],
+                y=drone_pos[:, 1],
+                z=drone_pos[:, 2],
                 mode='markers+text',
                 marker=drone_marker,
                 name=f"Drones at t={frame_num}",
@@ -1,5 +1,63 @@
 from utils import *
 import numpy as np
+import hashlib
+
+class PointRegistry:
+    """
+    Interns Points, giving each distinct one a dense integer id, with the
+    coordinates of id i in row i of an (n, 3) array. Tasks hold the ids of
+    their points, so distances between them are computed from the array
+    instead of from Points.
+    """
+
+    def __init__(self, points=()):
+        self.ids = {}
+        self.points = []
+        self._coords = np.empty((16, 3))
+        self.register_all(points)
+
+    def __repr__(self):
+        return f"PointRegistry(points={len(self.points)})"
+
+    def __len__(self):
+        return len(self.points)
+
+    def __contains__(self, point):
+        return point in self.ids
+
+    @property
+    def coords(self):
+        return self._coords[:len(self.points)]
+
+    def register(self, point):
+        """
+        Returns the id of point, adding it if it is new.
+        """
+        point_id = self.ids.get(point)
+        if point_id is None:
+            point_id = len(self.points)
+            if point_id == len(self._coords):
+                grown = np.empty((2 * len(self._coords), 3))
+                grown[:point_id] = self._coords
+                self._coords = grown
+            self._coords[point_id] = tuple(point)
+            self.ids[point] = point_id
+            self.points.append(point)
+        return point_id
+
+    def register_all(self, points):
+        return [self.register(point) for point in points]
+
+    def point(self, point_id):
+        return self.points[point_id]
+
+    def pair_distances(self, ids_a, ids_b):
+        """
+        Returns the Manhattan distance from point ids_a[i] to point ids_b[i]
+        for every i, as an array.
+        """
+        coords = self.coords
+        return np.abs(coords[ids_a] - coords[ids_b]).sum(axis=1)
 
 class WarehouseMap:
     def __init__(self, wh_info, resolution=0.1, units="ft"):
@@ -8,12 +66,17 @@ class WarehouseMap:
 
         self.pick_points = []
         self.drop_points = []
+        # Integer ids of the pick and drop points
+        self.points = PointRegistry()
 
         self.initialize_info(wh_info)
 
         self.blocked_areas, self.shelf_zone, self.wh_zone = self.generate_zones()
 
         self.occupancy_matrix = self.make_occupancy_matrix(self.resolution)
+
+        # Cell centers already converted, since committed paths revisit the same cells
+        self.cell_centers = {}
         
     def __repr__(self):
         return (f"WarehouseMap(wh_info=wh_info\n" + 
@@ -144,6 +207,9 @@ class WarehouseMap:
                 [Point(i, self.wh_zone.y_lims[1]-5, 5) for i in np.arange(5, self.wh_zone.y_lims[1], 20)]
             )
 
+        self.pick_ids = self.points.register_all(self.pick_points)
+        self.drop_ids = self.points.register_all(self.drop_points)
+
         return self.pick_points, self.drop_points
 
     def point_to_cell(self, point):
@@ -171,11 +237,15 @@ class WarehouseMap:
         Returns:
             Point: point where x, y, and z are in feet
         """
-        half_cell = 1/self.resolution /2
-        point_x = cell.x/self.resolution + self.wh_zone.x_lims[0] + half_cell
-        point_y = cell.y/self.resolution + self.wh_zone.y_lims[0] + half_cell
-        point_z = cell.z/self.resolution + self.wh_zone.z_lims[0] + half_cell
-        return Point(point_x, point_y, point_z)
+        point = self.cell_centers.get(cell)
+        if point is None:
+            half_cell = 1/self.resolution /2
+            point_x = cell.x/self.resolution + self.wh_zone.x_lims[0] + half_cell
+            point_y = cell.y/self.resolution + self.wh_zone.y_lims[0] + half_cell
+            point_z = cell.z/self.resolution + self.wh_zone.z_lims[0] + half_cell
+            point = Point(point_x, point_y, point_z)
+            self.cell_centers[cell] = point
+        return point
     
     def cell_to_point_edge(self, cell):
         """
@@ -228,6 +298,17 @@ class WarehouseMap:
                        zone_cell.z_lims[0]:zone_cell.z_lims[1]] = True
         return occ_matrix
 
+    def fingerprint(self):
+        """
+        Returns a hash of the occupancy matrix and its resolution, so that
+        anything cached from the map's static layout (e.g. shortest paths) can
+        be shared between maps that are laid out the same.
+        """
+        occ = np.ascontiguousarray(self.occupancy_matrix)
+        digest = hashlib.sha1(repr((occ.shape, self.resolution)).encode())
+        digest.update(occ.tobytes())
+        return digest.hexdigest()
+
     def get_occ_matrix_layer(self, layer_num):
         """
         Returns a matrix of 1s (blocked) and 0s (free) of the specified layer of the map (z-level).